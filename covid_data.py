@@ -238,8 +238,6 @@ def scrape_and_combine():
 
         # TODO: split vac slides as that's the slowest
 
-        briefings_prov__cases_briefings = pool.apply_async(covid_data_briefing.get_cases_by_prov_briefings)
-
         dash_ages = pool.apply_async(covid_data_dash.dash_ages)
 
         # today_situation = pool.apply_async(covid_data_situation.get_situation_today)
@@ -257,6 +255,11 @@ def scrape_and_combine():
         xcess_deaths = pool.apply_async(covid_data_api.excess_deaths)
         case_api_by_area = pool.apply_async(covid_data_api.get_cases_by_area_api)  # can be very wrong for the last days
 
+        # each briefing is parsed separately then combined in order once they are all done.
+        # Submitted last so the other scrapes aren't waiting on the list of briefings
+        briefings = [(link, date, pool.apply_async(covid_data_briefing.get_briefing, [link, date]))
+                     for link, date, _ in covid_data_briefing.briefing_documents()]
+
         # Now block getting until we get each of the data
         # today_situation = today_situation.get()
         th_situation = th_situation.get()
@@ -269,7 +272,8 @@ def scrape_and_combine():
 
         vac_reports, vac_reports_prov = vac_reports_and_prov.get()
         vac_slides = vac_slides.get()
-        briefings_prov, cases_briefings = briefings_prov__cases_briefings.get()
+        briefings_prov, cases_briefings = covid_data_briefing.get_cases_by_prov_briefings(
+            [(link, date, briefing.get()) for link, date, briefing in briefings])
         cases_demo, risks_prov = cases_demo__risks_prov.get()
 
         tweets_prov, twcases = tweets_prov__twcases.get()
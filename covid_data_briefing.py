@@ -1,18 +1,22 @@
 import datetime
 from dateutil.parser import parse as d
 from itertools import islice
+import os
 import re
 
-from bs4 import BeautifulSoup
 import numpy as np
 import pandas as pd
 
 from utils_pandas import daterange, export
-from utils_scraping import MAX_DAYS, USE_CACHE_DATA, any_in, camelot_cache, get_next_number, get_next_numbers, \
-    pairwise, parse_file, parse_numbers, seperate, split, \
+from utils_scraping import MAX_DAYS, USE_CACHE_DATA, any_in, camelot_tables, get_next_number, get_next_numbers, \
+    file_results, page_kinds, pairwise, parse_file, parse_numbers, seperate, split, \
     strip, web_files, NUM_OR_DASH, logger
 from utils_thai import file2date, find_thai_date, get_province, join_provinces, parse_gender, today
 
+# bump when any of the briefing parsers change so the stored results get parsed again
+BRIEFING_PARSER_VERSION = 5
+BRIEFINGS_PARSED = "inputs/briefings_parsed"
+
 
 def briefing_case_detail_lines(soup):
     parts = soup.find_all('p')
@@ -521,7 +525,7 @@ def briefing_deaths_summary(text, date, file):
     return row
 
 
-def briefing_deaths_cells(cells, date, all):
+def briefing_deaths_cells(cells, date):
     rows = []
     for cell in cells:
         lines = [line for line in cell.split("\n") if line.strip()]
@@ -561,10 +565,10 @@ def briefing_deaths_cells(cells, date, all):
         pd.DataFrame(rows, columns=['death_num', "Date", "gender", "age", "Province", "nationality",
                                     "congenital_disease", "case_history", "risk_factor_sickness",
                                     "risk_factor_death"]).set_index("death_num")
-    return all.append(df, verify_integrity=True)
+    return df
 
 
-def briefing_deaths_table(orig, date, all):
+def briefing_deaths_table(orig, date):
     """death details per quadrant or page, turned into table by camelot"""
     df = orig.drop(columns=[0, 10])
     df.columns = ['death_num', "gender", "nationality", "age", "Province",
@@ -576,7 +580,6 @@ def briefing_deaths_table(orig, date, all):
     df['gender'] = df['gender'].map(parse_gender)  # TODO: handle misspelling
     df = df.set_index("death_num")
     df = join_provinces(df, "Province")
-    all = all.append(df, verify_integrity=True)
     # parts = [l.get_text() for l in soup.find_all("p")]
     # parts = [l for l in parts if l]
     # preamble, *tables = split(parts, re.compile("ปัจจัยเสี่ยงการ").search)
@@ -586,12 +589,14 @@ def briefing_deaths_table(orig, date, all):
     #         row = ' '.join(first) + ' '.join(rest)
     #         case_num, age, *dates = get_next_numbers("")
     #         print(row)
-    return all
+    return df
 
 
 def briefing_deaths(file, date, pages):
     # Only before the 2021-04-29
-    all = pd.DataFrame()
+    deaths = []
+    death_pages = []
+    summary = None
     for i, soup in enumerate(pages):
         text = soup.get_text()
 
@@ -599,27 +604,36 @@ def briefing_deaths(file, date, pages):
         # Latest version of deaths. Only gives summary info
         dfprov = briefing_deaths_provinces(text, date, file)
         if not sum.empty:
-            return all, sum, dfprov
+            summary = sum, dfprov
+            break
 
-        if "วิตของประเทศไทย" not in text:
-            continue
+        if "วิตของประเทศไทย" in text:
+            death_pages.append(i)
+    if death_pages and date > d("2021-04-19"):
+        # Individual case detail for death. Get camelot to read all the pages at once
+        tables = camelot_tables(file, [i + 2 for i in death_pages], process_background=True)
+
+    for i in death_pages:
         orig = None
         if date <= d("2021-04-19"):
-            cells = [soup.get_text()]
+            cells = [pages[i].get_text()]
         else:
-            # Individual case detail for death
-            orig = camelot_cache(file, i + 2, process_background=True)
+            orig = tables[i + 2][0]
             if len(orig.columns) != 11:
                 cells = [cell for r in orig.itertuples() for cell in r[1:] if cell]
             else:
                 cells = []
         if cells:
             # Older style, not row per death
-            all = briefing_deaths_cells(cells, date, all)
+            deaths.append(briefing_deaths_cells(cells, date))
         elif orig is not None:  # <= 2021-04-27
-            all = briefing_deaths_table(orig, date, all)
+            deaths.append(briefing_deaths_table(orig, date))
         else:
             raise Exception(f"Couldn't parse deaths {date}")
+    # join once rather than copying everything so far for each page
+    all = pd.concat(deaths, verify_integrity=True) if deaths else pd.DataFrame()
+    if summary is not None:
+        return (all,) + summary
 
     if all.empty:
         logger.info("{}: Deaths:  0", date.date())
@@ -662,6 +676,14 @@ def briefing_atk(file, date, pages):
     return df
 
 
+def get_briefing_file(link):
+    try:
+        file, text, url = next(iter(web_files(link, dir="inputs/briefings")))
+    except StopIteration:
+        return None
+    return file
+
+
 def briefing_documents(check=True):
     url = "http://media.thaigov.go.th/uploads/public_img/source/"
     start = d("2021-01-13")  # 12th gets a bit messy but could be fixed
@@ -676,47 +698,94 @@ def briefing_documents(check=True):
             break
 
         def get_file(link=link):
-            try:
-                file, text, url = next(iter(web_files(link, dir="inputs/briefings")))
-            except StopIteration:
-                return None
-            return file
+            return get_briefing_file(link)
 
         yield link, date, get_file
 
 
-def get_cases_by_prov_briefings():
+# what each parser needs to find on a page. Pages are checked once and only given to the parsers that might want them
+BRIEFING_PAGES = dict(
+    case_types="รายงานสถานการณ์",
+    case_detail="ผู้ป่วยรายใหม่ประเทศไทย",
+    province_cases=re.compile(r"(นวนผู้ติดเชื้อโควิดในประเทศรำยใหม่|อโควิดในประเทศรายให)"),
+    atk="ยอดตรวจ ATK",
+    vac=re.compile("(ผู้รับวัคซีน|ผูรั้บวัคซีน)"),
+)
+
+
+def parse_briefing(briefing_url, date, file):
+    "run all the parsers over a single briefing"
+    pages = parse_file(file, html=True, paged=True, parsed=True)
+    kinds = [page_kinds(page.get_text(), BRIEFING_PAGES) for page in pages]
+
+    def pages_of(kind):
+        return [page for page, page_kind in zip(pages, kinds) if kind in page_kind]
+
+    today_types = briefing_case_types(date, pages_of("case_types"), briefing_url)
+    case_detail = briefing_case_detail(date, pages_of("case_detail"))
+    prov = briefing_province_cases(file, date, pages_of("province_cases"))
+    atk = briefing_atk(file, date, pages_of("atk"))
+    # deaths uses the page numbers for camelot so gets them all
+    each_death, death_sum, death_by_prov = briefing_deaths(file, date, pages)
+
+    # TODO: This should be redundant now with dashboard having early info on vac progress.
+    vac = pd.DataFrame(columns=["Date"]).set_index("Date")
+    for page in pages_of("vac"):
+        text = page.get_text()
+        # Might throw out totals since doesn't include all prov
+        # vac_prov = vac_briefing_provs(vac_prov, date, file, page, text)
+        vac = vac_briefing_totals(vac, date, file, page, text)
+    return today_types, case_detail, prov, atk, each_death, death_sum, death_by_prov, vac
+
+
+def briefing_results(briefing_url, date, file):
+    "parse_briefing results, stored per briefing so only new or changed briefings get parsed again"
+    # 2021-07-24 has two briefings so include the file name
+    store = os.path.join(BRIEFINGS_PARSED, f"{date.date()}_{os.path.basename(file)}.pickle")
+    return file_results(file, store, BRIEFING_PARSER_VERSION, lambda: parse_briefing(briefing_url, date, file))
+
+
+def get_briefing(briefing_url, date):
+    "download and parse a single briefing so they can be done in parallel"
+    file = get_briefing_file(briefing_url)
+    if file is None:
+        return None
+    return briefing_results(briefing_url, date, file)
+
+
+def get_cases_by_prov_briefings(briefings=None):
+    """Combine the results of each briefing, newest first.
+    briefings are (url, date, get_briefing results) in briefing_documents order or else they are parsed here."""
     logger.info("========Briefings==========")
+    if briefings is None:
+        briefings = [(briefing_url, date, get_briefing(briefing_url, date))
+                     for briefing_url, date, _ in briefing_documents()]
+    briefings = [(briefing_url, date, results) for briefing_url, date, results in briefings if results is not None]
+
     types = pd.DataFrame(columns=["Date", ]).set_index(['Date', ])
     date_prov = pd.DataFrame(columns=["Date", "Province"]).set_index(['Date', 'Province'])
     date_prov_types = pd.DataFrame(columns=["Date", "Province", "Case Type"]).set_index(['Date', 'Province'])
     # deaths = import_csv("deaths", ["Date", "Province"], not USE_CACHE_DATA)
     deaths = pd.DataFrame(columns=["Date", "Province"]).set_index(['Date', 'Province'])
     vac_prov = pd.DataFrame(columns=["Date", "Province"]).set_index(['Date', 'Province'])
-    for briefing_url, date, get_file in briefing_documents():
-        file = get_file()
-        if file is None:
-            continue
-        pages = parse_file(file, html=True, paged=True)
-        pages = [BeautifulSoup(page, 'html.parser') for page in pages]
+    each_deaths = []
+    for briefing_url, date, results in briefings:
+        today_types, case_detail, prov, atk, each_death, death_sum, death_by_prov, vac = results
 
-        today_types = briefing_case_types(date, pages, briefing_url)
         types = types.combine_first(today_types)
-
-        case_detail = briefing_case_detail(date, pages)
         date_prov_types = date_prov_types.combine_first(case_detail)
+        types = types.combine_first(vac)
 
-        prov = briefing_province_cases(file, date, pages)
+        each_deaths.append(each_death)
+        date_prov = date_prov.combine_first(death_by_prov)
+        types = types.combine_first(death_sum).combine_first(atk)
 
-        atk = briefing_atk(file, date, pages)
+        date_prov = date_prov.combine_first(prov)
+    deaths = pd.concat([deaths] + each_deaths, verify_integrity=True)
 
-        each_death, death_sum, death_by_prov = briefing_deaths(file, date, pages)
-        # TODO: This should be redundant now with dashboard having early info on vac progress.
-        for i, page in enumerate(pages):
-            text = page.get_text()
-            # Might throw out totals since doesn't include all prov
-            # vac_prov = vac_briefing_provs(vac_prov, date, file, page, text)
-            types = vac_briefing_totals(types, date, file, page, text)
+    # Do some checks across the data
+    for briefing_url, date, results in briefings:
+        today_types, case_detail, prov, atk, each_death, death_sum, death_by_prov, vac = results
 
         if not today_types.empty:
             wrong_deaths_report = date in [
@@ -733,13 +802,6 @@ def get_cases_by_prov_briefings():
                 death_sum.last_valid_index()]['Deaths']
             assert wrong_deaths_report or (ddeaths == ideaths) or date in [d("2021-08-27"), d("2021-09-10")], f"Death details {ddeaths} didn't match total {ideaths}"
 
-        deaths = deaths.append(each_death, verify_integrity=True)
-        date_prov = date_prov.combine_first(death_by_prov)
-        types = types.combine_first(death_sum).combine_first(atk)
-
-        date_prov = date_prov.combine_first(prov)
-
-        # Do some checks across the data
         today_total = today_types[['Cases Proactive', "Cases Walkin"]].sum().sum()
         prov_total = prov.groupby("Date").sum()['Cases'].loc[date]
         warning = f"briefing provs={prov_total}, cases={today_total}"
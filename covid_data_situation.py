@@ -8,11 +8,14 @@ from bs4 import BeautifulSoup
 import numpy as np
 import pandas as pd
 
-from utils_pandas import check_cum, cum2daily, export, import_csv
-from utils_scraping import MAX_DAYS, USE_CACHE_DATA, any_in, get_next_number, get_next_numbers, \
-    parse_file, web_files, web_links, logger
+from utils_pandas import check_cum, combine_first_all, cum2daily, export, import_csv
+from utils_scraping import MAX_DAYS, USE_CACHE_DATA, any_in, file_results, get_next_number, get_next_numbers, \
+    parse_file, stored_results, web_files, web_links, logger
 from utils_thai import file2date, find_thai_date
 
+SITUATION_PARSER_VERSION = 2
+SITUATION_PARSED = "inputs/situation_parsed"
+
 
 ##########################################
 # Situation reports/PUI
@@ -281,8 +284,28 @@ def get_english_situation_files(check=False):
         yield link, date, dl_file
 
 
+def situation_report_en(file, date):
+    "row of numbers from a single english situation report"
+    parsed_pdf = parse_file(file, html=False, paged=False).replace("\u200b", "")
+    parsed_pdf = parsed_pdf.replace("DDC Thailand 1", "")  # footer put in the wrong place
+
+    pui = situation_pui_en(parsed_pdf, date)
+    cases = situation_cases_cum(parsed_pdf, date)
+    new_cases = situation_cases_new(parsed_pdf, date)
+    return pui.combine_first(cases).combine_first(new_cases)
+
+
+def situation_reports(dir, rows, stores):
+    "rows of each report parsed plus, when only the latest are looked at, those stored from earlier runs"
+    if USE_CACHE_DATA:
+        rows = rows + list(stored_results(dir, SITUATION_PARSER_VERSION, skip=stores))
+    results = combine_first_all(rows)
+    return results if not results.empty else pd.DataFrame(columns=["Date"]).set_index("Date")
+
+
 def get_en_situation():
-    results = pd.DataFrame(columns=["Date"]).set_index("Date")
+    dir = os.path.join(SITUATION_PARSED, "en")
+    rows, stores = [], set()
     for link, date, dl_file in get_english_situation_files():
         if (file := dl_file()) is None:
             continue
@@ -291,14 +314,10 @@ def get_en_situation():
             continue
         if date <= dateutil.parser.parse("2020-01-30"):
             continue  # TODO: can manually put in numbers before this
-        parsed_pdf = parse_file(file, html=False, paged=False).replace("\u200b", "")
-        parsed_pdf = parsed_pdf.replace("DDC Thailand 1", "")  # footer put in the wrong place
-
-        pui = situation_pui_en(parsed_pdf, date)
-        cases = situation_cases_cum(parsed_pdf, date)
-        new_cases = situation_cases_new(parsed_pdf, date)
-        row = pui.combine_first(cases).combine_first(new_cases)
-        results = results.combine_first(row)
+        store = os.path.join(dir, f"{os.path.basename(file)}.pickle")
+        stores.add(store)
+        row = file_results(file, store, SITUATION_PARSER_VERSION, lambda: situation_report_en(file, date))
+        rows.append(row)
         # cums = [c for c in results.columns if ' Cum' in c]
         # if len(results) > 1 and (results.iloc[0][cums] > results.iloc[1][cums]).any():
         #     print((results.iloc[0][cums] > results.iloc[1][cums]))
@@ -313,6 +332,7 @@ def get_en_situation():
         #     "q{Cases In Quarantine Cum:.0f}({Cases In Quarantine:.0f})\t"
         #     "".format(**row)
         # )
+    results = situation_reports(dir, rows, stores)
     # Missing data. filled in from th infographic
     missing = [
         (d("2020-12-19"), 2476, 0, 0),
@@ -495,22 +515,38 @@ def get_thai_situation_files(check=False):
         yield link, date, dl_file
 
 
+def situation_report_th(file, date, results):
+    "row of numbers from a single thai situation report. results of later reports are used to check the cumulative numbers"
+    parsed_pdf = parse_file(file, html=False, paged=False)
+    if "Situation Total number of PUI" in parsed_pdf:
+        # english report mixed up? - situation-no171-220663.pdf
+        return pd.DataFrame()
+    # another report for the same day isn't mixed into this one's row
+    results = results[results.index != date]
+    results = situation_pui_th(results, parsed_pdf, date, file)
+    results = situation_pui_th_death(results, parsed_pdf, date, file)
+    return results[results.index == date]
+
+
 def get_thai_situation():
-    results = pd.DataFrame(columns=["Date"]).set_index("Date")
+    dir = os.path.join(SITUATION_PARSED, "th")
+    rows, stores = [], set()
+    earliest = pd.DataFrame()
     for link, date, dl_file in get_thai_situation_files():
         if (file := dl_file()) is None:
             continue
 
-        parsed_pdf = parse_file(file, html=False, paged=False)
         if "situation" not in os.path.basename(file):
             continue
-        if "Situation Total number of PUI" in parsed_pdf:
-            # english report mixed up? - situation-no171-220663.pdf
-            continue
-        results = situation_pui_th(results, parsed_pdf, date, file)
-        results = situation_pui_th_death(results, parsed_pdf, date, file)
-
-    return results
+        store = os.path.join(dir, f"{os.path.basename(file)}.pickle")
+        stores.add(store)
+        row = file_results(file, store, SITUATION_PARSER_VERSION, lambda: situation_report_th(file, date, earliest))
+        rows.append(row)
+        # check_cum only looks at the earliest day so far so only the earliest two days are kept
+        earliest = combine_first_all([earliest, row])
+        earliest = earliest[earliest.index.isin(earliest.index.unique()[:2])]
+
+    return situation_reports(dir, rows, stores)
 
 
 def get_situation_today():
@@ -8,9 +8,9 @@ import numpy as np
 import pandas as pd
 import requests
 
-from utils_pandas import daily2cum, export, import_csv
+from utils_pandas import daily2cum, daily2cum_prov, export, import_csv
 from utils_scraping import MAX_DAYS, USE_CACHE_DATA, any_in, get_next_number, get_next_numbers, \
-    pairwise, parse_file, parse_numbers, replace_matcher, split, \
+    page_kinds, pairwise, parse_file, parse_numbers, replace_matcher, split, \
     web_files, web_links, NUM_OR_DASH, logger, camelot_cache
 from utils_thai import area_crosstab, find_thai_date, get_province, join_provinces, today
 
@@ -137,8 +137,11 @@ def vac_problem(daily, date, file, page):
     return daily.combine_first(df)
 
 
+vac_daily_re = re.compile(r"(ให้หน่วยบริกำร|ใหห้นว่ยบริกำร|สรปุกำรจดัสรรวคัซนีโควดิ 19|ริการวัคซีนโควิด 19|ผู้ได้รับวัคซีนเข็มที่ 1)")  # noqa
+
+
 def vaccination_daily(daily, date, file, page):
-    if not re.search(r"(ให้หน่วยบริกำร|ใหห้นว่ยบริกำร|สรปุกำรจดัสรรวคัซนีโควดิ 19|ริการวัคซีนโควิด 19|ผู้ได้รับวัคซีนเข็มที่ 1)", page):  # noqa
+    if not vac_daily_re.search(page):
         return daily
     date = find_thai_date(page)
     # fix numbers with spaces in them
@@ -277,6 +280,11 @@ def vaccination_daily(daily, date, file, page):
     return daily
 
 
+vac_shots_re = re.compile(r"(เข็ม(?:ที|ที่|ท่ี)\s.?(?:1|2)\s*)")
+vac_july_re = re.compile(r"\( *(?:ร้อยละ|รอ้ยละ) *\)", re.DOTALL)
+vac_oldhead_re = re.compile(r"(เข็มที่ 1 วัคซีน|เข็มท่ี 1 และ|เข็มที ่1 และ)")
+
+
 def vaccination_tables(df, date, page, file):
     date = find_thai_date(page)
     givencols = [
@@ -337,9 +345,7 @@ def vaccination_tables(df, date, page, file):
         assert rows.get((date, prov), None) is None or rows.get((date, prov), None).keys() != cols
         rows[(date, prov)] = {c: n for c, n in zip(cols, [date, prov] + numbers)} | rows.get((date, prov), {})
 
-    shots = re.compile(r"(เข็ม(?:ที|ที่|ท่ี)\s.?(?:1|2)\s*)")
-    july = re.compile(r"\( *(?:ร้อยละ|รอ้ยละ) *\)", re.DOTALL)
-    oldhead = re.compile(r"(เข็มที่ 1 วัคซีน|เข็มท่ี 1 และ|เข็มที ่1 และ)")
+    shots, july, oldhead = vac_shots_re, vac_july_re, vac_oldhead_re
 
     def in_heading(pat):
         return max(len(pat.findall(h)) for h in headings)
@@ -505,7 +511,7 @@ def vaccination_reports_files2(check=True):
     # or https://ddc.moph.go.th/dcd/pagecontent.php?page=643&dept=dcd
     folders = [f"https://ddc.moph.go.th/vaccine-covid19/diaryReportMonth/{m:02}/9/2021" for m in range(3, 13)]
 
-    links = (link for f in folders for link in web_links(f, ext=".pdf", check=check))
+    links = web_links(*folders, ext=".pdf", check=check)
     # links = sorted(links, reverse=True)
     links = reversed(list(links))
     count = 0
@@ -523,6 +529,14 @@ def vaccination_reports_files2(check=True):
         yield link, None, get_file
 
 
+# what each parser needs to find on a page. Pages are checked once and only given to the parsers that might want them
+VAC_REPORT_PAGES = dict(
+    tables=re.compile("|".join(r.pattern for r in [vac_july_re, vac_shots_re, vac_oldhead_re])),
+    daily=vac_daily_re,
+    problem="Anaphylaxis",
+)
+
+
 def vaccination_reports():
     vac_daily = pd.DataFrame(columns=['Date']).set_index("Date")
     vac_prov_reports = pd.DataFrame(columns=['Date', 'Province']).set_index(["Date", "Province"])
@@ -535,13 +549,15 @@ def vaccination_reports():
             continue
         table = pd.DataFrame(columns=["Date", "Province"]).set_index(["Date", "Province"])
         for page in parse_file(file):
-            found_date = find_thai_date(page)
             if date is None:
-                date = found_date
-            table = vaccination_tables(table, date, page, file)
-
-            vac_daily = vaccination_daily(vac_daily, date, file, page)
-            vac_daily = vac_problem(vac_daily, date, file, page)
+                date = find_thai_date(page)
+            kinds = page_kinds(page, VAC_REPORT_PAGES)
+            if "tables" in kinds:
+                table = vaccination_tables(table, date, page, file)
+            if "daily" in kinds:
+                vac_daily = vaccination_daily(vac_daily, date, file, page)
+            if "problem" in kinds:
+                vac_daily = vac_problem(vac_daily, date, file, page)
         logger.info("{} Vac Tables {} {} {}", date, len(table), "Provinces parsed", file)
         # TODO: move this into vaccination_tables so can be tested
         if d("2021-05-04") <= date <= d("2021-08-01") and len(table) < 77:
@@ -605,7 +621,7 @@ def get_vac_coldchain():
     vacct['Vac Given'] = vacct.sum(axis=1, skipna=False)
     vacct = vacct.loc[:today() - datetime.timedelta(days=1)]  # Today's data is incomplete
     vacct = vacct.fillna(0)
-    vaccum = vacct.groupby(level="Province", as_index=False, group_keys=False).apply(daily2cum)
+    vaccum = daily2cum_prov(vacct)
     vacct = vacct.combine_first(vaccum)
 
     # Their data can have some prov on the last day missing data
@@ -777,7 +793,7 @@ def vac_slides_groups(df, page, file, page_num):
 
 def vac_slides_files(check=True):
     folders = [f"https://ddc.moph.go.th/vaccine-covid19/diaryPresentMonth/{m}/10/2021" for m in range(1, 12)]
-    links = sorted((link for f in folders for link in web_links(f, ext=".pdf", check=check)), reverse=True)
+    links = sorted(web_links(*folders, ext=".pdf", check=check), reverse=True)
     count = 0
     for link in links:
         if USE_CACHE_DATA and count > MAX_DAYS:
@@ -1,3 +1,4 @@
+import os
 import pathlib
 
 import matplotlib
@@ -6,6 +7,7 @@ import matplotlib.pyplot as plt
 import pandas as pd
 
 from covid_data import scrape_and_combine
+from covid_plot_utils import chart_exporter, plot_renderer
 from utils_scraping import logger
 
 from covid_plot_tests import save_tests_plots
@@ -26,20 +28,24 @@ def save_plots(df: pd.DataFrame) -> None:
     pathlib.Path('./outputs').mkdir(parents=True, exist_ok=True)
 
 
-    # Tests Plots
-    save_tests_plots(df)
+    # pngs are rendered in other processes while the next plots are being worked out
+    # or with PLOT_HTML=True just the chart data is saved for the html viewer in outputs/charts
+    output = chart_exporter() if os.environ.get('PLOT_HTML', False) == 'True' else plot_renderer()
+    with output:
+        # Tests Plots
+        save_tests_plots(df)
 
-    # Vaccinations Plots
-    save_vacs_plots(df)
+        # Vaccinations Plots
+        save_vacs_plots(df)
 
-    # Cases Plots
-    save_cases_plots(df)
+        # Cases Plots
+        save_cases_plots(df)
 
-    # Deaths Plots
-    save_deaths_plots(df)
+        # Deaths Plots
+        save_deaths_plots(df)
 
-    # active/hosp Plots
-    save_active_plots(df)
+        # active/hosp Plots
+        save_active_plots(df)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,5 @@
+import functools
+
 import matplotlib.cm
 import pandas as pd
 import numpy as np
@@ -5,7 +7,7 @@ import numpy as np
 from covid_data import get_ifr, scrape_and_combine
 from covid_data_api import get_case_details_csv
 from utils_pandas import cum2daily, cut_ages, cut_ages_labels, decreasing, get_cycle, perc_format, \
-    import_csv, increasing, normalise_to_total, rearrange, topprov, fuzzy_join
+    import_csv, increasing, normalise_to_total, rearrange, fuzzy_join, ProvinceRanking
 from utils_scraping import remove_prefix, logger
 from utils_thai import DISTRICT_RANGE, DISTRICT_RANGE_SIMPLE, AREA_LEGEND, \
     FIRST_AREAS, area_crosstab, join_provinces, trend_table
@@ -206,18 +208,20 @@ def save_cases_plots(df: pd.DataFrame) -> None:
     #           footnote='Proactive: Testing done at high risk locations, rather than random sampling.',
     #           footnote_left=f'{source}Data Source: CCSA Daily Briefing')
 
+    @functools.lru_cache(maxsize=100, typed=False)
     def cases_per_capita(col):
         def func(adf):
             return adf[col] / adf['Population'] * 100000
 
         return func
 
-    top5 = cases.pipe(topprov,
-                      increasing(cases_per_capita("Cases")),
-                      cases_per_capita("Cases"),
-                      name="Province Cases (3d MA)",
-                      other_name="Other Provinces",
-                      num=5)
+    # metrics are cached by function so the same func must be used for charts to share them
+    ranking = ProvinceRanking(cases)
+    top5 = ranking.top(increasing(cases_per_capita("Cases")),
+                       cases_per_capita("Cases"),
+                       name="Province Cases (3d MA)",
+                       other_name="Other Provinces",
+                       num=5)
     cols = top5.columns.to_list()
     plot_area(df=top5,
               title='Confirmed Covid Cases/100k - Trending Up Provinces - Thailand',
@@ -228,12 +232,11 @@ def save_cases_plots(df: pd.DataFrame) -> None:
               footnote='\nNote: Per 100,000 people.',
               footnote_left=f'\n{source}Data Sources: CCSA Daily Briefing\n  API: Daily Reports of COVID-19 Infections')
 
-    top5 = cases.pipe(topprov,
-                      decreasing(cases_per_capita("Cases")),
-                      cases_per_capita("Cases"),
-                      name="Province Cases (3d MA)",
-                      other_name="Other Provinces",
-                      num=5)
+    top5 = ranking.top(decreasing(cases_per_capita("Cases")),
+                       cases_per_capita("Cases"),
+                       name="Province Cases (3d MA)",
+                       other_name="Other Provinces",
+                       num=5)
     cols = top5.columns.to_list()
     plot_area(df=top5,
               title='Confirmed Covid Cases/100k - Trending Down Provinces - Thailand',
@@ -244,11 +247,10 @@ def save_cases_plots(df: pd.DataFrame) -> None:
               footnote='\nNote: Per 100,000 people.',
               footnote_left=f'\n{source}Data Sources: CCSA Daily Briefing\n  API: Daily Reports of COVID-19 Infections')
 
-    top5 = cases.pipe(topprov,
-                      cases_per_capita("Cases"),
-                      name="Province Cases",
-                      other_name="Other Provinces",
-                      num=5)
+    top5 = ranking.top(cases_per_capita("Cases"),
+                       name="Province Cases",
+                       other_name="Other Provinces",
+                       num=5)
     cols = top5.columns.to_list()
 
     plot_area(df=top5,
@@ -259,12 +261,11 @@ def save_cases_plots(df: pd.DataFrame) -> None:
               cmap='tab10',
               footnote_left=f'{source}Data Sources: CCSA Daily Briefing\n  API: Daily Reports of COVID-19 Infections')
 
-    top5 = cases.pipe(topprov,
-                      increasing(cases_per_capita('Cases Walkin'), 14),
-                      cases_per_capita('Cases Walkin'),
-                      name="Province Cases Walkin (7d MA)",
-                      other_name="Other Provinces",
-                      num=5)
+    top5 = ranking.top(increasing(cases_per_capita('Cases Walkin'), 14),
+                       cases_per_capita('Cases Walkin'),
+                       name="Province Cases Walkin (7d MA)",
+                       other_name="Other Provinces",
+                       num=5)
     cols = top5.columns.to_list()
     plot_area(df=top5,
               title='"Walk-in" Covid Cases/100k - Top Provinces - Thailand',
@@ -278,12 +279,11 @@ def save_cases_plots(df: pd.DataFrame) -> None:
               footnote_left=f'\n{source}Data Sources: CCSA Daily Briefing\n  API: Daily Reports of COVID-19 Infections')
 
     for risk in ['Contact', 'Proactive Search', 'Community', 'Work', 'Unknown']:
-        top5 = cases.pipe(topprov,
-                          increasing(cases_per_capita(f"Cases Risk: {risk}")),
-                          cases_per_capita(f"Cases Risk: {risk}"),
-                          name=f"Province Cases {risk} (7d MA)",
-                          other_name="Other Provinces",
-                          num=5)
+        top5 = ranking.top(increasing(cases_per_capita(f"Cases Risk: {risk}")),
+                           cases_per_capita(f"Cases Risk: {risk}"),
+                           name=f"Province Cases {risk} (7d MA)",
+                           other_name="Other Provinces",
+                           num=5)
         cols = top5.columns.to_list()
         plot_area(df=top5,
                   title=f'{risk} Related Covid Cases/100k - Trending Up Provinces - Thailand',
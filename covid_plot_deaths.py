@@ -4,7 +4,7 @@ from pandas.tseries.offsets import MonthEnd
 
 from covid_data import get_ifr, scrape_and_combine
 from utils_pandas import cum2daily, cut_ages, cut_ages_labels, decreasing, get_cycle, perc_format, \
-    import_csv, increasing, normalise_to_total, rearrange, topprov
+    import_csv, increasing, normalise_to_total, rearrange, topprov, ProvinceRanking
 from utils_scraping import remove_prefix, logger
 from utils_thai import DISTRICT_RANGE, DISTRICT_RANGE_SIMPLE, AREA_LEGEND, \
     FIRST_AREAS, area_crosstab, join_provinces, trend_table
@@ -447,7 +447,8 @@ see https://djay.github.io/covidthailand/#excess-deaths
 
     by_province = excess.groupby(["Province"]).apply(calc_pscore)
     by_province['Deaths Covid'] = cases.groupby(["Province", pd.Grouper(level=0, freq='M')])['Deaths'].sum()
-    top5 = by_province.pipe(topprov, lambda adf: (adf["Excess Deaths"] - adf['Deaths Covid']) / adf['Pre 5 Avg'] * 100, num=5)
+    ranking = ProvinceRanking(by_province)
+    top5 = ranking.top(lambda adf: (adf["Excess Deaths"] - adf['Deaths Covid']) / adf['Pre 5 Avg'] * 100, num=5)
     cols = top5.columns.to_list()
     plot_area(df=top5, 
               title='Deviation from Expected Monthly Deaths - Thailand',
@@ -459,7 +460,7 @@ see https://djay.github.io/covidthailand/#excess-deaths
               footnote='Note: Average 2015-19 plus known Covid deaths.\n' + footnote5,
               footnote_left=f'{source}Data Sources: Office of Registration Administration\n  Department of Provincial Administration')
 
-    top5 = by_province.pipe(topprov, lambda adf: adf["Excess Deaths"], num=7)
+    top5 = ranking.top(lambda adf: adf["Excess Deaths"], num=7)
     cols = top5.columns.to_list()
     plot_area(df=top5,
               title='Excess Deaths - Highest Provinces - Thailand',
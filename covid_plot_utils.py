@@ -1,16 +1,26 @@
+from contextlib import contextmanager
+import gzip
+import hashlib
+import inspect
+import json
+from multiprocessing import Pool
 import os
+import shutil
 from typing import Sequence, Union, List, Callable
 
 import matplotlib
 import matplotlib.cm
+import matplotlib.colors
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
 import numpy as np
 import pandas as pd
 import numpy as np
 
+import utils_pandas
 from utils_pandas import get_cycle, human_format, perc_format, set_time_series_labels_2
-from utils_scraping import remove_suffix, logger
+from utils_scraping import remove_suffix, unique_values, logger
+import utils_thai
 from utils_thai import thaipop, thaipop2
 
 source = 'Source: https://djay.github.io/covidthailand - (CC BY)\n'
@@ -23,6 +33,114 @@ theme_dark_text = '#424242'
 theme_light_back = '#202020'
 theme_dark_back = '#0C1111'
 
+# set by plot_renderer so plot_area renders pngs in other processes
+render_pool = None
+render_jobs = []
+# derived series (e.g. moving averages) shared between the plots of one plot_renderer session
+derived_cache = None
+# set by chart_exporter so plot_area saves chart specs and data for the html viewer instead of pngs
+chart_export = None
+
+
+def code_version(*files) -> str:
+    "md5 of the source of the plotting code and the versions of the libraries that draw it"
+    md5 = hashlib.md5(f"{matplotlib.__version__} {pd.__version__} {np.__version__}".encode())
+    for file in files:
+        with open(file, 'rb') as f:
+            md5.update(f.read())
+    return md5.hexdigest()
+
+
+# pngs are re-rendered when the plotting code changes as well as the data
+render_version = code_version(__file__, utils_pandas.__file__, utils_thai.__file__)
+
+
+def set_plot_theme() -> None:
+    """Apply the matplotlib settings shared by every plot. Also used to set up each render process."""
+    plt.rcParams.update({
+        "font.size": 20,
+        "figure.titlesize": 30,
+        "figure.titleweight": "bold",
+        "legend.fontsize": 18,
+        "xtick.labelsize": 20,
+        "ytick.labelsize": 20,
+        # "axes.prop_cycle": get_cycle(cmap),
+    })
+
+    if theme == 'Black':
+        plt.rcParams.update({
+            "text.color": theme_light_text,
+            "legend.facecolor": theme_light_back,
+            "legend.edgecolor": theme_label_text,
+            "legend.frameon": True,
+            "legend.framealpha": 0.3,
+            "legend.shadow": True,
+            "axes.grid" : True, 
+            "axes.facecolor": theme_dark_back,
+            "axes.linewidth": 0,
+            "grid.color": theme_label_text,
+            "grid.alpha": 0.5,
+            "xtick.color": theme_label_text,
+            "xtick.minor.size": 0,
+            "ytick.color": theme_label_text,
+            "ytick.minor.size": 0,
+        })
+
+
+def init_render_process() -> None:
+    """Set up matplotlib once in each process of the render pool, the same as covid_plot.save_plots does."""
+    matplotlib.use('AGG')
+    plt.style.use('dark_background')
+    set_plot_theme()
+
+
+@contextmanager
+def plot_renderer(processes: int = None):
+    """While inside this block plot_area sends each png to a pool of processes to be rendered.
+    Waits for all the pngs to be saved before exiting the block."""
+    global render_pool, derived_cache
+    with Pool(processes, initializer=init_render_process) as pool:
+        render_pool = pool
+        derived_cache = {}
+        try:
+            yield pool
+            for job in render_jobs:
+                job.get()  # raise any errors from rendering
+        finally:
+            render_pool = None
+            derived_cache = None
+            render_jobs.clear()
+
+
+@contextmanager
+def chart_exporter(dir: str = os.path.join("outputs", "charts")):
+    """While inside this block plot_area saves a json spec of each chart instead of rendering pngs.
+    The data for all the charts is saved once at the end into a single file along with the html viewer."""
+    global chart_export
+    os.makedirs(dir, exist_ok=True)
+    chart_export = dict(dir=dir, indexes={}, columns={}, keys={}, charts={})
+    try:
+        yield chart_export
+        with gzip.open(os.path.join(dir, "data.json.gz"), "wt") as f:
+            json.dump(dict(indexes=chart_export['indexes'], columns=chart_export['columns']), f)
+        with open(os.path.join(dir, "charts.json"), "w") as f:
+            json.dump(chart_export['charts'], f, indent=1)
+        shutil.copy(os.path.join(os.path.dirname(__file__), "assets", "charts.html"), os.path.join(dir, "index.html"))
+        logger.info("Charts: {} charts, {} columns in {}", len(chart_export['charts']), len(chart_export['columns']), dir)
+    finally:
+        chart_export = None
+
+
+def rolling_ma(series: pd.Series, ma_days: int) -> pd.Series:
+    """Centred moving average as used by plot_area. Memoised on the data for the current plot_renderer session."""
+    if derived_cache is None:
+        return series.rolling(ma_days, min_periods=int(ma_days / 2), center=True).mean()
+    key = (series.name, ma_days, hashlib.sha1(pd.util.hash_pandas_object(series).values).hexdigest())
+    if key not in derived_cache:
+        derived_cache[key] = series.rolling(ma_days, min_periods=int(ma_days / 2), center=True).mean()
+    return derived_cache[key]
+
+
 def plot_area(df: pd.DataFrame,
               png_prefix: str,
               cols_subset: Union[str, Sequence[str]],
@@ -82,39 +200,7 @@ def plot_area(df: pd.DataFrame,
 
     orig_cols = cols
 
-    plt.rcParams.update({
-        "font.size": 20,
-        "figure.titlesize": 30,
-        "figure.titleweight": "bold",
-        "legend.fontsize": 18,
-        "xtick.labelsize": 20,
-        "ytick.labelsize": 20,
-        # "axes.prop_cycle": get_cycle(cmap),
-    })
-
-    if theme == 'Black':
-        plt.rcParams.update({
-            "text.color": theme_light_text,
-            "legend.facecolor": theme_light_back,
-            "legend.edgecolor": theme_label_text,
-            "legend.frameon": True,
-            "legend.framealpha": 0.3,
-            "legend.shadow": True,
-            "axes.grid" : True, 
-            "axes.facecolor": theme_dark_back,
-            "axes.linewidth": 0,
-            "grid.color": theme_label_text,
-            "grid.alpha": 0.5,
-            "xtick.color": theme_label_text,
-            "xtick.minor.size": 0,
-            "ytick.color": theme_label_text,
-            "ytick.minor.size": 0,
-        })
-        dim_color = '#784d00'
-        invisible_color = theme_dark_back
-    else:
-        dim_color = 'lightgrey'
-        invisible_color = 'white'
+    set_plot_theme()
 
     if actuals:
         # display the originals dashed along side MA
@@ -123,10 +209,19 @@ def plot_area(df: pd.DataFrame,
     else:
         actuals = []
 
+    if box_cols and type(box_cols[0]) != list:
+        box_cols = [box_cols]
+    elif not box_cols:
+        box_cols = []
+
+    # work on just the columns needed so derived columns aren't added to the callers frame
+    input_cols = cols + [unknown_total, unknown_name] + between + actuals + [c for dist in box_cols for c in dist]
+    df = df[[c for c in unique_values(input_cols) if c in df.columns]].copy()
+
     if ma_days:
         ma_suffix = ' (MA)'
         for c in cols:
-            df[f'{c}{ma_suffix}'] = df[c].rolling(ma_days, min_periods=int(ma_days / 2), center=True).mean()
+            df[f'{c}{ma_suffix}'] = rolling_ma(df[c], ma_days)
         cols = [f'{c}{ma_suffix}' for c in cols]
     else:
         ma_suffix = ''
@@ -138,12 +233,10 @@ def plot_area(df: pd.DataFrame,
 
     if unknown_total:
         if ma_days:
-            df[f'{unknown_total}{ma_suffix}'] = df[unknown_total].rolling(ma_days,
-                                                                          min_periods=int(ma_days / 2),
-                                                                          center=True).mean()
+            df[f'{unknown_total}{ma_suffix}'] = rolling_ma(df[unknown_total], ma_days)
         total_col = f'{unknown_total}{ma_suffix}'
         unknown_col = f'{unknown_name}{ma_suffix}'
-        other_cols = set(cols) - set([unknown_col])
+        other_cols = [c for c in cols if c != unknown_col]  # keep the order so sums are repeatable
         # TODO: should not be 0 when no unknown_total
         df[unknown_col] = df[total_col].sub(df[other_cols].sum(axis=1), fill_value=None).clip(lower=0)
         if unknown_col not in cols:
@@ -205,106 +298,353 @@ def plot_area(df: pd.DataFrame,
         else:
             periods_to_plot = set(periods.keys())
 
-        periods = {key: periods[key] for key in periods_to_plot}
+        periods = {key: df_period for key, df_period in periods.items() if key in periods_to_plot}
     else:
         periods = {'all': df_clean}
 
+    box_index = df.index if box_cols else None
+
+    # If actuals are after cols then they are future predictions. put in a line to show today
+    if actuals and df[cols].last_valid_index() < df[actuals].last_valid_index():
+        today_line = df[cols].last_valid_index()
+    else:
+        today_line = None
+
+    # only the columns needed for drawing get sent to the render processes
+    plot_cols = cols + between + actuals + (perccols if percent_fig else []) + [c for dist in box_cols for c in dist]
+    plot_cols = [c for c in unique_values(plot_cols) if c in df.columns]
+
+    # everything except the data is the same for each period so they are rendered together on one figure
+    chart = dict(png_prefix=png_prefix, cols=cols, title=title, subtitle=subtitle, footnote=footnote,
+                 footnote_left=footnote_left, legends=legends, legend_pos=legend_pos, legend_cols=legend_cols,
+                 kind=kind, stacked=stacked, percent_fig=percent_fig, perccols=perccols if percent_fig else [],
+                 table=table, limit_to_zero=limit_to_zero, ma_suffix=ma_suffix, cmap=cmap, actuals=actuals,
+                 highlight=highlight, box_cols=box_cols, box_index=box_index, today_line=today_line,
+                 y_formatter=y_formatter, between=between, is_dates=is_dates)
+    if chart_export is not None:
+        export_chart(df_clean[plot_cols], periods, **chart)
+        return None
+
+    to_render = {}
     for suffix, df_plot in periods.items():
         if df_plot.empty:
             continue
+        df_plot = df_plot[plot_cols]
+        path = os.path.join("outputs", f'{png_prefix}_{suffix}.png')
+        fingerprint = plot_fingerprint(dict(chart, df_plot=df_plot, suffix=suffix))
+        if os.path.exists(path) and os.path.exists(f"{path}.md5"):
+            with open(f"{path}.md5") as f:
+                if f.read() == fingerprint:
+                    logger.info("Plot: {} unchanged", path)
+                    continue
+        to_render[suffix] = (df_plot, fingerprint)
+
+    if not to_render:
+        pass
+    elif render_pool is None:
+        render_plot(periods=to_render, **chart)
+    else:
+        render_jobs.append(render_pool.apply_async(render_plot, kwds=dict(chart, periods=to_render)))
 
-        plt.rcParams["axes.prop_cycle"] = get_cycle(cmap, len(cols) + len(between))
-
-        show_province_tables = len(table) > 0
-
-        # element heights
-        fn_left_lines = len(footnote_left.split('\n')) if footnote_left else 0
-        fn_right_lines = len(footnote.split('\n')) if footnote else 0
-        footnote_height = max(fn_left_lines, fn_right_lines)
-
-        # figure out the figure dimensions
-        figure_height = 21
-        figure_width = 20
-        grid_rows = 1
-        grid_columns = 5
-        main_rows = 1
-        if percent_fig:
-            figure_height += 7
-            grid_rows += 2
-            main_rows = 2
-        if show_province_tables:
-            figure_height += 7
-            grid_rows += 2
-            main_rows = 2
-        fig = plt.figure(figsize=[figure_width, 0.5 * figure_height + 0.4 * footnote_height])
-
-
-        grid_offset = 0
-        # main chart
-        a0 = plt.subplot2grid((grid_rows, grid_columns), (0, 0), colspan=grid_columns, rowspan=main_rows)
-        grid_offset += main_rows
-
-        # percent chart
-        if percent_fig:
-            a1 = plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 0), colspan=grid_columns, rowspan=1)
-            grid_offset += 1
-
-        # province tables
-        if show_province_tables:
-            ax_provinces = []
-            ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 0), colspan=1, rowspan=1))
-            add_footnote(footnote_left, 'left')
-            ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 1), colspan=1, rowspan=1))
-            ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 2), colspan=1, rowspan=1))
-            ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 3), colspan=1, rowspan=1))
-            ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 4), colspan=1, rowspan=1))
-            add_footnote(footnote, 'right')
+    return None
 
-            add_to_table(ax_provinces[0], table, ['Bangkok Metropolitan Region', 'Central', ])
-            add_to_table(ax_provinces[1], table, ['Western', 'Eastern'])
-            add_to_table(ax_provinces[2], table, ['Northeastern'])
-            add_to_table(ax_provinces[3], table, ['Northern'])
-            add_to_table(ax_provinces[4], table, ['Southern'])
 
+def json_values(values) -> list:
+    """Values of a column or index as json, dates as 2021-05-05 and missing or infinite values as null."""
+    if isinstance(values, pd.DatetimeIndex):
+        return [None if pd.isna(d) else d.strftime('%Y-%m-%d') for d in values]
+    values = [v.item() if isinstance(v, np.generic) else v for v in values]
+    return [None if pd.isna(v) or v in (np.inf, -np.inf) else v for v in values]
+
+
+def export_column(series: pd.Series) -> str:
+    """Add a column to the shared chart data and return its key. The same data is only stored once."""
+    index_key = hashlib.md5(pd.util.hash_pandas_object(series.index).values.tobytes()).hexdigest()[:10]
+    if index_key not in chart_export['indexes']:
+        chart_export['indexes'][index_key] = json_values(series.index)
+    data_hash = hashlib.md5(pd.util.hash_pandas_object(series).values.tobytes()).hexdigest()
+    if data_hash not in chart_export['keys']:
+        # different charts can have different data under the same column name
+        key = str(series.name) if str(series.name) not in chart_export['columns'] else f"{series.name} {data_hash[:8]}"
+        chart_export['keys'][data_hash] = key
+        chart_export['columns'][key] = dict(index=index_key, values=json_values(series.to_numpy()))
+    return chart_export['keys'][data_hash]
+
+
+def export_chart(df_plot: pd.DataFrame,
+                 periods: dict,
+                 png_prefix: str,
+                 cols: List[str],
+                 title: str,
+                 subtitle: str,
+                 footnote: str,
+                 footnote_left: str,
+                 legends: List[str],
+                 legend_pos: str,
+                 legend_cols: int,
+                 kind: str,
+                 stacked: bool,
+                 percent_fig: bool,
+                 perccols: List[str],
+                 table: pd.DataFrame,
+                 limit_to_zero: bool,
+                 ma_suffix: str,
+                 cmap: str,
+                 actuals: List[str],
+                 highlight: List[str],
+                 box_cols: List[List[str]],
+                 box_index: pd.Index,
+                 today_line,
+                 y_formatter: Callable[[float, int], str],
+                 between: List[str],
+                 is_dates: bool) -> None:
+    """Save a json spec of how to draw a plot_area chart with the html viewer, using the same colours and
+    styles as the pngs. The data goes into the shared chart data."""
+    colors = [matplotlib.colors.to_hex(c['color'], keep_alpha=False) for c in get_cycle(cmap, len(cols) + len(between))]
+    if kind != "line":
+        areacols = [c for c in cols if c not in between]
+        linecols = between
+    else:
+        areacols = []
+        linecols = cols
+    labels = dict(zip(cols, legends))
+
+    # colours follow the order the pngs use them in: areas, then lines, then actuals repeating the cycle
+    series = []
+    color = 0
+    for c in areacols:
+        series.append(dict(column=export_column(df_plot[c]), label=labels.get(c), type=kind, color=colors[color % len(colors)]))
+        color += 1
+    color += len(areacols)
+    for c in linecols:
+        series.append(dict(column=export_column(df_plot[c]), label=labels.get(c), type="line",
+                           color=colors[color % len(colors)],
+                           dash=c in [f"{b}{ma_suffix}" for b in between] + actuals,
+                           width=5 if c in [f"{h}{ma_suffix}" for h in highlight] else 2))
+        color += 1
+    for c in actuals:
+        series.append(dict(column=export_column(df_plot[c]), label=None, type="line", color=colors[color % len(colors)],
+                           dash=True, width=2, alpha=0.5))
+        color += 1
+
+    spec = dict(
+        title=title,
+        subtitle=subtitle,
+        footnote=footnote,
+        footnote_left=footnote_left,
+        legend_pos=legend_pos,
+        legend_cols=legend_cols,
+        stacked=stacked,
+        limit_to_zero=limit_to_zero,
+        y_format=getattr(y_formatter, '__name__', None),
+        today=json_values(pd.DatetimeIndex([today_line]) if is_dates else [today_line])[0],
+        periods={suffix: json_values(df_period.index[[0, -1]]) for suffix, df_period in periods.items()
+                 if not df_period.empty},
+        series=series,
+        percent=[dict(column=export_column(df_plot[c]), color=colors[i % len(colors)]) for i, c in enumerate(perccols)],
+        boxes=[[export_column(df_plot[c]) for c in dist] for dist in box_cols],
+    )
+    with open(os.path.join(chart_export['dir'], f"{png_prefix}.json"), "w") as f:
+        json.dump(spec, f, indent=1)
+    chart_export['charts'][png_prefix] = title
+    logger.info("Chart: {}", png_prefix)
+
+
+def plot_fingerprint(job: dict) -> str:
+    """md5 of everything render_plot uses so a png whose data and settings haven't changed can be skipped."""
+    md5 = hashlib.md5(render_version.encode())
+    for key, value in sorted(job.items()):
+        md5.update(key.encode())
+        if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+            md5.update(pd.util.hash_pandas_object(value).values.tobytes())
+            if isinstance(value, pd.DataFrame):
+                md5.update(repr(list(value.columns)).encode())
+        elif callable(value):
+            try:
+                md5.update(inspect.getsource(value).encode())
+            except (OSError, TypeError):
+                md5.update(f"{value.__module__}.{value.__qualname__}".encode())
         else:
+            md5.update(repr(value).encode())
+    return md5.hexdigest()
+
+
+def render_plot(periods: dict,
+                png_prefix: str,
+                cols: List[str],
+                title: str,
+                subtitle: str,
+                footnote: str,
+                footnote_left: str,
+                legends: List[str],
+                legend_pos: str,
+                legend_cols: int,
+                kind: str,
+                stacked: bool,
+                percent_fig: bool,
+                perccols: List[str],
+                table: pd.DataFrame,
+                limit_to_zero: bool,
+                ma_suffix: str,
+                cmap: str,
+                actuals: List[str],
+                highlight: List[str],
+                box_cols: List[List[str]],
+                box_index: pd.Index,
+                today_line,
+                y_formatter: Callable[[float, int], str],
+                between: List[str],
+                is_dates: bool) -> None:
+    """Draws and saves a .png for each period of a plot_area chart. Can be run in another process.
+
+    :param periods: dict of file suffix to (data for that period, fingerprint saved with the png)
+    """
+
+    plt.rcParams["axes.prop_cycle"] = get_cycle(cmap, len(cols) + len(between))
+
+    fig, grid = figure_template(title, footnote, footnote_left, percent_fig, table)
+    show_province_tables = len(table) > 0
+
+    a0 = a1 = None
+    for suffix, (df_plot, fingerprint) in periods.items():
+        # only the chart axes are replaced for each period. New axes so no pandas plotting state carries over
+        for axis in [a0, a1]:
+            if axis is not None:
+                axis.remove()
+        a0, a1 = chart_axes(grid, percent_fig)
+        if not show_province_tables:
+            # footnotes are attached to the bottom chart
             add_footnote(footnote_left, 'left')
             add_footnote(footnote, 'right')
 
-        a0.set_prop_cycle(None)
-        if kind != "line":
-            areacols = [c for c in cols if c not in between]
-            df_plot.plot(ax=a0, y=areacols, kind=kind, stacked=stacked, legend='reverse')
-            linecols = between
-        else:
-            areacols = []
-            linecols = cols
+        draw_period(df_plot, a0, a1, cols, subtitle, legends, legend_pos, legend_cols, kind, stacked, percent_fig,
+                    perccols, limit_to_zero, ma_suffix, actuals, highlight, box_cols, box_index, today_line,
+                    y_formatter, between, is_dates)
 
-        # advance colour cycle so lines have correct next colour
-        for _ in range(len(areacols)):
-            next(a0._get_lines.prop_cycler)
+        # laid out from the figure defaults each time so a png is the same whichever periods are drawn with it
+        fig.subplots_adjust(**{k: plt.rcParams[f"figure.subplot.{k}"]
+                               for k in ["left", "right", "bottom", "top", "wspace", "hspace"]})
+        plt.tight_layout(pad=1.107, w_pad=-10.0, h_pad=1.0)
+        path = os.path.join("outputs", f'{png_prefix}_{suffix}.png')
+        plt.savefig(path, facecolor=theme_light_back)
+        if fingerprint:
+            # saved after the png so a failed render is retried next time
+            with open(f"{path}.md5", "w") as f:
+                f.write(fingerprint)
+        logger.info("Plot: {}", path)
+    plt.close(fig)
 
-        for c in linecols:
-            style = "--" if c in [f"{b}{ma_suffix}" for b in between] + actuals else None
-            width = 5 if c in [f"{h}{ma_suffix}" for h in highlight] else 2
-            df_plot.plot(ax=a0,
-                         y=c,
-                         use_index=True,
-                         linewidth=width,
-                         style=style,
-                         kind="line",
-                         zorder=4,
-                         legend=c not in actuals,
-                         x_compat=kind == 'bar'  # Putting lines on bar plots doesn't work well
-                         )
 
-        # reset colours and plot actuals repeating same colours used by lines
-        if actuals:
-            # TODO: There has to be a less dodgy way than this?
-            #a0._get_lines.prop_cycler = iter(get_cycle(cmap))
-            # a0._get_lines.set_prop_cycle(get_cycle(cmap))
-            # plt.rcParams["axes.prop_cycle"] = get_cycle(cmap)
-            # a0.set_prop_cycle(None)
-            # plt.gca().set_prop_cycle(None)
+def figure_template(title, footnote, footnote_left, percent_fig, table):
+    """Create the figure and the parts of it that are the same for every period: title, province tables and
+    footnotes. Returns the figure and the grid for chart_axes."""
+    show_province_tables = len(table) > 0
+
+    # element heights
+    fn_left_lines = len(footnote_left.split('\n')) if footnote_left else 0
+    fn_right_lines = len(footnote.split('\n')) if footnote else 0
+    footnote_height = max(fn_left_lines, fn_right_lines)
+
+    # figure out the figure dimensions
+    figure_height = 21
+    figure_width = 20
+    grid_rows = 1
+    grid_columns = 5
+    main_rows = 1
+    if percent_fig:
+        figure_height += 7
+        grid_rows += 2
+        main_rows = 2
+    if show_province_tables:
+        figure_height += 7
+        grid_rows += 2
+        main_rows = 2
+    fig = plt.figure(figsize=[figure_width, 0.5 * figure_height + 0.4 * footnote_height])
+
+    grid_offset = main_rows + (1 if percent_fig else 0)
+
+    # province tables
+    if show_province_tables:
+        ax_provinces = []
+        ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 0), colspan=1, rowspan=1))
+        add_footnote(footnote_left, 'left')
+        ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 1), colspan=1, rowspan=1))
+        ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 2), colspan=1, rowspan=1))
+        ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 3), colspan=1, rowspan=1))
+        ax_provinces.append(plt.subplot2grid((grid_rows, grid_columns), (grid_offset, 4), colspan=1, rowspan=1))
+        add_footnote(footnote, 'right')
+
+        add_to_table(ax_provinces[0], table, ['Bangkok Metropolitan Region', 'Central', ])
+        add_to_table(ax_provinces[1], table, ['Western', 'Eastern'])
+        add_to_table(ax_provinces[2], table, ['Northeastern'])
+        add_to_table(ax_provinces[3], table, ['Northern'])
+        add_to_table(ax_provinces[4], table, ['Southern'])
+
+    fig.suptitle(title)
+    return fig, (grid_rows, grid_columns, main_rows)
+
+
+def chart_axes(grid, percent_fig):
+    """Create the main chart axis and, if needed, the percent chart axis below it."""
+    grid_rows, grid_columns, main_rows = grid
+    # main chart
+    a0 = plt.subplot2grid((grid_rows, grid_columns), (0, 0), colspan=grid_columns, rowspan=main_rows)
+    # percent chart
+    a1 = None
+    if percent_fig:
+        a1 = plt.subplot2grid((grid_rows, grid_columns), (main_rows, 0), colspan=grid_columns, rowspan=1)
+    return a0, a1
+
+
+def draw_period(df_plot, a0, a1, cols, subtitle, legends, legend_pos, legend_cols, kind, stacked, percent_fig,
+                perccols, limit_to_zero, ma_suffix, actuals, highlight, box_cols, box_index, today_line,
+                y_formatter, between, is_dates):
+    """Plot the data for one period onto the chart axes."""
+    a0.set_prop_cycle(None)
+    if kind != "line":
+        areacols = [c for c in cols if c not in between]
+        df_plot.plot(ax=a0, y=areacols, kind=kind, stacked=stacked, legend='reverse')
+        linecols = between
+    else:
+        areacols = []
+        linecols = cols
+
+    # advance colour cycle so lines have correct next colour
+    for _ in range(len(areacols)):
+        next(a0._get_lines.prop_cycler)
+
+    # once pandas has set up the date axis the rest of the lines are drawn directly from the numpy values
+    for c in linecols:
+        style = "--" if c in [f"{b}{ma_suffix}" for b in between] + actuals else None
+        width = 5 if c in [f"{h}{ma_suffix}" for h in highlight] else 2
+        x = line_x(a0, kind)
+        if x is not None:
+            plot_values(a0, x, df_plot[c], style=style, linewidth=width, zorder=4)
+            continue
+        df_plot.plot(ax=a0,
+                     y=c,
+                     use_index=True,
+                     linewidth=width,
+                     style=style,
+                     kind="line",
+                     zorder=4,
+                     legend=c not in actuals,
+                     x_compat=kind == 'bar'  # Putting lines on bar plots doesn't work well
+                     )
+
+    # reset colours and plot actuals repeating same colours used by lines
+    if actuals:
+        # TODO: There has to be a less dodgy way than this?
+        #a0._get_lines.prop_cycler = iter(get_cycle(cmap))
+        # a0._get_lines.set_prop_cycle(get_cycle(cmap))
+        # plt.rcParams["axes.prop_cycle"] = get_cycle(cmap)
+        # a0.set_prop_cycle(None)
+        # plt.gca().set_prop_cycle(None)
+        x = line_x(a0, kind)
+        if x is not None:
+            for c in actuals:
+                plot_values(a0, x, df_plot[c], style="--", linewidth=2, alpha=0.5, zorder=4)
+        else:
             df_plot.plot(ax=a0,
                          y=actuals,
                          use_index=True,
@@ -317,67 +657,75 @@ def plot_area(df: pd.DataFrame,
                          x_compat=kind == 'bar'  # Putting lines on bar plots doesn't work well
                          )
 
-        # If actuals are after cols then they are future predictions. put in a line to show today
-        if actuals and df[cols].last_valid_index() < df[actuals].last_valid_index():
-            a0.axvline(df[cols].last_valid_index(), color='grey', linestyle='--', lw=1)
-
-        if box_cols and type(box_cols[0]) != list:
-            box_cols = [box_cols]
-        elif not box_cols:
-            box_cols = []
-        for dist in box_cols:
-            mins, maxes, avg = df_plot[dist].min(axis=1), df_plot[dist].max(axis=1), df_plot[dist].mean(axis=1)
-            a0.fill_between(df.index, mins, maxes, facecolor="yellow", alpha=0.3, zorder=3, label=None, step=None)
+    # If actuals are after cols then they are future predictions. put in a line to show today
+    if today_line is not None:
+        a0.axvline(today_line, color='grey', linestyle='--', lw=1)
+
+    for dist in box_cols:
+        mins, maxes, avg = df_plot[dist].min(axis=1), df_plot[dist].max(axis=1), df_plot[dist].mean(axis=1)
+        a0.fill_between(box_index, mins, maxes, facecolor="yellow", alpha=0.3, zorder=3, label=None, step=None)
+        x = line_x(a0, kind)
+        if x is not None:
+            plot_values(a0, x, avg, style="--", color="orange", zorder=5)
+        else:
             avg.plot(ax=a0, color="orange", style="--", zorder=5, x_compat=kind == 'bar', legend=False)
-            # boxes = df_plot[box_cols].transpose()
-            # boxes.boxplot(ax=a0)
+        # boxes = df_plot[box_cols].transpose()
+        # boxes.boxplot(ax=a0)
 
-        if kind == "bar" and is_dates:
-            set_time_series_labels_2(df_plot, a0)
+    if kind == "bar" and is_dates:
+        set_time_series_labels_2(df_plot, a0)
 
-        fig.suptitle(title)
-        a0.set_title(label=subtitle)
+    a0.set_title(label=subtitle)
 
-        handles, labels = a0.get_legend_handles_labels()
-        # we are skipping pandas determining which legends to show so do it manually. box lines are 'None'
-        # TODO: go back to pandas doing it.
-        handles, labels = zip(*[(h, l) for h, l in zip(*a0.get_legend_handles_labels()) if l not in actuals + ['None']])
+    handles, labels = a0.get_legend_handles_labels()
+    # we are skipping pandas determining which legends to show so do it manually. box lines are 'None'
+    # TODO: go back to pandas doing it.
+    handles, labels = zip(*[(h, l) for h, l in zip(*a0.get_legend_handles_labels()) if l not in actuals + ['None']])
 
-        leg = a0.legend(handles=handles, labels=legends)
+    leg = a0.legend(handles=handles, labels=legends)
 
-        for line in leg.get_lines():
-            line.set_linewidth(4.0)
+    for line in leg.get_lines():
+        line.set_linewidth(4.0)
 
-        clean_axis(a0, y_formatter)
-        if limit_to_zero: a0.set_ylim(bottom=0)
+    clean_axis(a0, y_formatter)
+    if limit_to_zero: a0.set_ylim(bottom=0)
 
-        if percent_fig:
-            clean_axis(a1, perc_format)
-            a1.set_ylim(bottom=0, top=100)
-            df_plot.plot(ax=a1, y=perccols, kind='area', legend=False)
+    if percent_fig:
+        clean_axis(a1, perc_format)
+        a1.set_ylim(bottom=0, top=100)
+        df_plot.plot(ax=a1, y=perccols, kind='area', legend=False)
 
-            right_axis(a1, perc_format)
-            right_value_axis(df_plot, a1, leg, perccols, True, perc_format, 13)
-            # legends = rewrite_legends(df_plot, legends, perccols, perc_format)
+        right_axis(a1, perc_format)
+        right_value_axis(df_plot, a1, leg, perccols, True, perc_format, 13)
+        # legends = rewrite_legends(df_plot, legends, perccols, perc_format)
 
-        right_axis(a0, y_formatter)
-        if not (kind == 'bar' and stacked == False):
-            right_value_axis(df_plot, a0, leg, cols, stacked, y_formatter)
+    right_axis(a0, y_formatter)
+    if not (kind == 'bar' and stacked == False):
+        right_value_axis(df_plot, a0, leg, cols, stacked, y_formatter)
 
-        # legends = rewrite_legends(df_plot, legends, cols, y_formatter)
+    # legends = rewrite_legends(df_plot, legends, cols, y_formatter)
 
-        a0.legend(handles=handles,
-                  labels=legends,
-                  loc=legend_pos,
-                  ncol=legend_cols)
+    a0.legend(handles=handles,
+              labels=legends,
+              loc=legend_pos,
+              ncol=legend_cols)
 
-        plt.tight_layout(pad=1.107, w_pad=-10.0, h_pad=1.0)
-        path = os.path.join("outputs", f'{png_prefix}_{suffix}.png')
-        plt.savefig(path, facecolor=theme_light_back)
-        logger.info("Plot: {}", path)
-        plt.close()
 
-    return None
+def line_x(axis, kind):
+    """x values of the first line pandas drew on this axis, in axis units, so more lines can be drawn directly."""
+    if kind == 'bar' or not axis.get_lines():
+        return None  # lines on bar charts need pandas x_compat
+    return axis.get_lines()[0].get_xdata(orig=False)
+
+
+def plot_values(axis, x, series, style=None, **kwargs):
+    """Draw a column as a line, the same as series.plot(ax=axis) but without pandas redoing the index each time."""
+    y = series.to_numpy()
+    mask = pd.isna(y)
+    if mask.any():
+        y = np.ma.masked_where(mask, y)
+    args = (x, y, style) if style is not None else (x, y)
+    return axis.plot(*args, label=str(series.name), **kwargs)
 
 
 def trend_indicator(trend, style):
@@ -1,11 +1,14 @@
+import functools
+
 import matplotlib.cm
 import pandas as pd
 import numpy as np
 import re
 
 from covid_data import get_ifr, scrape_and_combine
-from utils_pandas import cum2daily, cut_ages, cut_ages_labels, decreasing, get_cycle, human_format, perc_format, \
-    import_csv, increasing, normalise_to_total, rearrange, set_time_series_labels_2, topprov, pred_vac, fix_gaps
+from utils_pandas import cum2daily, cum2daily_prov, cut_ages, cut_ages_labels, decreasing, get_cycle, human_format, \
+    perc_format, import_csv, increasing, normalise_to_total, rearrange, set_time_series_labels_2, pred_vac, fix_gaps, \
+    ProvinceRanking
 from utils_scraping import remove_prefix, remove_suffix, any_in, logger
 from utils_thai import DISTRICT_RANGE, DISTRICT_RANGE_SIMPLE, AREA_LEGEND, AREA_LEGEND_SIMPLE, \
     AREA_LEGEND_ORDERED, FIRST_AREAS, area_crosstab, get_provinces, join_provinces, thaipop, thaipop2, trend_table
@@ -336,7 +339,7 @@ def save_vacs_plots(df: pd.DataFrame) -> None:
 
 
 
-    vac_prov_daily = vac.groupby("Province", group_keys=True).apply(cum2daily)
+    vac_prov_daily = cum2daily_prov(vac)
     vac_prov_daily = vac_prov_daily.join(get_provinces()[['Population', 'region']], on='Province')
     vac_prov_daily = vac_prov_daily.join(pops, rsuffix="2")
 
@@ -376,7 +379,16 @@ def save_vacs_plots(df: pd.DataFrame) -> None:
     #           footnote_left=f'{source}Data Source: MOPH Covid-19 Dashboard')
 
 
-    top5 = vac.pipe(topprov, lambda df: df['Vac Given 1 Cum'] / df['Vac Population2'] * 100)
+    @functools.lru_cache(maxsize=100, typed=False)
+    def vac_perc(dose, lowest=False):
+        def func(adf):
+            perc = adf[f'Vac Given {dose} Cum'] / adf['Vac Population2'] * 100
+            return -perc if lowest else perc
+        return func
+
+    # metrics are cached by function so the same func must be used for charts to share them
+    ranking = ProvinceRanking(vac)
+    top5 = ranking.top(vac_perc(1))
     pred = pred_vac(top5)
     pred = pred.clip(upper=pred.iloc[0].clip(100), axis=1)  # no more than 100% unless already over
     cols = top5.columns.to_list()
@@ -391,13 +403,9 @@ def save_vacs_plots(df: pd.DataFrame) -> None:
               footnote_left=f'{source}Data Sources: MOPH Covid-19 Dashboard\n  DDC Daily Vaccination Reports',
               footnote='Percentage include ages 0-18')
 
-    top5 = vac.pipe(topprov, lambda df: df['Vac Given 2 Cum'] / df['Vac Population2'] * 100)
+    top5 = ranking.top(vac_perc(2))
     # since top5 might be different need to recalculate
-    top5_dose1 = vac.pipe(
-        topprov, 
-        lambda df: df['Vac Given 2 Cum'] / df['Vac Population2'] * 100,
-        lambda df: df['Vac Given 1 Cum'] / df['Vac Population2'] * 100,
-    )
+    top5_dose1 = ranking.top(vac_perc(2), vac_perc(1))
     _, pred = pred_vac(top5_dose1, top5)
     pred = pred.clip(upper=pred.iloc[0].clip(100), axis=1)  # no more than 100% unless already over
     cols = top5.columns.to_list()
@@ -412,9 +420,7 @@ def save_vacs_plots(df: pd.DataFrame) -> None:
               footnote_left=f'{source}Data Sources: MOPH Covid-19 Dashboard\n  DDC Daily Vaccination Reports',
               footnote="Percentage include ages 0-18")
 
-    top5 = vac.pipe(topprov, lambda df: -df['Vac Given 1 Cum'] / df['Vac Population2'] * 100,
-                    lambda df: df['Vac Given 1 Cum'] / df['Vac Population2'] * 100,
-                    other_name=None, num=7)
+    top5 = ranking.top(vac_perc(1, lowest=True), vac_perc(1), other_name=None, num=7)
     cols = top5.columns.to_list()
     pred = pred_vac(top5)
     pred = pred.clip(upper=pred.iloc[0].clip(100), axis=1)  # no more than 100% unless already over
@@ -429,13 +435,9 @@ def save_vacs_plots(df: pd.DataFrame) -> None:
               footnote_left=f'{source}Data Sources: MOPH Covid-19 Dashboard\n  DDC Daily Vaccination Reports',
               footnote='Percentage include ages 0-18')
 
-    top5 = vac.pipe(topprov, lambda df: -df['Vac Given 2 Cum'] / df['Vac Population2'] * 100,
-                    lambda df: df['Vac Given 2 Cum'] / df['Vac Population2'] * 100,
-                    other_name=None, num=7)
+    top5 = ranking.top(vac_perc(2, lowest=True), vac_perc(2), other_name=None, num=7)
     cols = top5.columns.to_list()
-    top5_dose1 = vac.pipe(topprov, lambda df: -df['Vac Given 2 Cum'] / df['Vac Population2'] * 100,
-                    lambda df: df['Vac Given 1 Cum'] / df['Vac Population2'] * 100,
-                    other_name=None, num=7)
+    top5_dose1 = ranking.top(vac_perc(2, lowest=True), vac_perc(1), other_name=None, num=7)
     _, pred = pred_vac(top5_dose1, top5)
     pred = pred.clip(upper=pred.iloc[0].clip(100), axis=1)  # no more than 100% unless already over
     plot_area(df=top5.combine_first(pred), 
@@ -0,0 +1,78 @@
+"""Micro-benchmark of Ticks.reduce_overlap against an array based version. Run with python tests/bench_ticks.py
+
+With the 5-60 ticks of a chart the numpy overhead outweighs the python loops so reduce_overlap stays as loops.
+"""
+import timeit
+
+import numpy as np
+
+from covid_plot_utils import Tick, Ticks
+
+
+def push_up(values, bottom, spacing):
+    "v[i] = max(values[i], v[i - 1] + spacing) as the largest of values[k] + (i - k) * spacing for k <= i"
+    positions = np.arange(-1, len(values))
+    starts = np.concatenate([[bottom - spacing], values])
+    steps = starts - positions * spacing
+    start = np.maximum.accumulate(np.where(steps >= np.maximum.accumulate(steps), positions, -1))
+    return (starts[start + 1] + (positions - start) * spacing)[1:]
+
+
+def reduce_overlap_arrays(ticks):
+    "Ticks.reduce_overlap with the up passes as numpy cumulative maximums"
+    if len(ticks.ticks) > ticks.max_ticks:
+        ticks.spacing = (ticks.top - ticks.bottom) / (len(ticks.ticks) - 1)
+    spacing = ticks.spacing
+    actuals = np.array([tick.actual for tick in ticks.ticks], dtype=float)
+    order = np.argsort(actuals, kind="stable")
+    actuals = actuals[order]
+    values = push_up(actuals, ticks.bottom, spacing)
+    # halfway back pass depends on the last tick so can't be done as arrays
+    adjusted_last = False
+    last_value = ticks.top + spacing
+    for i in reversed(range(len(values))):
+        if values[i] > last_value - spacing:
+            values[i] = last_value - spacing
+        else:
+            adjusted_last = False
+        if not adjusted_last and values[i] > actuals[i]:
+            values[i] -= (values[i] - actuals[i]) / 2.0
+            adjusted_last = True
+        last_value = values[i]
+    values = push_up(values, ticks.bottom, spacing)
+    ticks.ticks = [ticks.ticks[i] for i in order]
+    for tick, value in zip(ticks.ticks, values.tolist()):
+        tick.value = value
+
+
+def make_ticks(values, max_ticks=27, bottom=0.0, top=100.0):
+    ticks = Ticks(max_ticks, bottom, top)
+    for number, value in enumerate(values):
+        ticks.append(Tick(value, str(number), None))
+    return ticks
+
+
+def random_values(rng, count):
+    # bunched up values like the last values of stacked or similar lines
+    return (rng.choice([rng.uniform(0, 100, count), rng.normal(50, 5, count), rng.uniform(90, 100, count)])).tolist()
+
+
+def test_reduce_overlap_arrays_same_as_loops():
+    rng = np.random.default_rng(0)
+    for count in list(range(1, 40)) * 20:
+        values = random_values(rng, count)
+        arrays, loops = make_ticks(values), make_ticks(values)
+        reduce_overlap_arrays(arrays)
+        loops.reduce_overlap()
+        assert arrays.get_labels() == loops.get_labels()
+        np.testing.assert_allclose(arrays.get_ticks(), loops.get_ticks(), rtol=0, atol=1e-9)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    for count in [5, 14, 27, 60]:
+        values = random_values(rng, count)
+        setup = timeit.timeit(lambda: make_ticks(values), number=2000)
+        loops = timeit.timeit(lambda: make_ticks(values).reduce_overlap(), number=2000) - setup
+        arrays = timeit.timeit(lambda: reduce_overlap_arrays(make_ticks(values)), number=2000) - setup
+        print(f"{count:3} ticks: loops {loops / 2 * 1e3:6.1f}us arrays {arrays / 2 * 1e3:6.1f}us")
@@ -1,9 +1,11 @@
+import copy
 import os
 import fnmatch
+import pickle
 from utils_thai import file2date
 
 from bs4 import BeautifulSoup
-from utils_scraping import parse_file, pptx2chartdata, sanitize_filename
+from utils_scraping import Page, parse_file, pptx2chartdata, sanitize_filename
 from covid_data_briefing import briefing_atk, briefing_case_types, briefing_deaths_provinces, \
     briefing_deaths_summary, briefing_documents, briefing_province_cases, vac_briefing_totals
 from covid_data_testing import get_test_files, get_tests_by_area_chart_pptx, get_tests_by_area_pdf
@@ -192,19 +194,19 @@ def find_testing_pdf(check):
 
 @pytest.mark.parametrize("fname, testdf, dl", dl_files("testing_moph_pptx", find_testing_pptx))
 def test_get_tests_by_area_chart_pptx(fname, testdf, dl):
-    data, raw = pd.DataFrame(), pd.DataFrame()
+    raw = pd.DataFrame()
     assert dl is not None
     file = dl()
     assert file is not None
     for chart, title, series, pagenum in pptx2chartdata(file):
-        data, raw = get_tests_by_area_chart_pptx(input, title, series, data, raw)
+        raw = get_tests_by_area_chart_pptx(input, title, series, raw)
     # write_scrape_data_back_to_test(raw, "testing_moph", fname)
     pd.testing.assert_frame_equal(testdf, raw, check_dtype=False)
 
 
 @pytest.mark.parametrize("fname, testdf, dl", dl_files("testing_moph_pdf", find_testing_pdf))
 def test_get_tests_by_area_chart_pdf(fname, testdf, dl):
-    data, raw = pd.DataFrame(), pd.DataFrame()
+    raw = pd.DataFrame()
     if fname is None:
         # It's a pptx that doesn't have pdf version
         return
@@ -213,7 +215,7 @@ def test_get_tests_by_area_chart_pdf(fname, testdf, dl):
     assert file is not None
     pages = parse_file(file, html=False, paged=True)
     for page in pages:
-        data, raw = get_tests_by_area_pdf(file, page, data, raw)
+        raw = get_tests_by_area_pdf(file, page, raw)
     # write_scrape_data_back_to_test(raw, "testing_moph", fname)
     if testdf.index.max() >= dateutil.parser.parse("2021-08-08"):
         # plots stopped having numbers for positives so aren't scraped
@@ -284,6 +286,29 @@ def test_briefing_case_types(date, testdf, dl):
     pd.testing.assert_frame_equal(testdf, df, check_dtype=False)
 
 
+@pytest.mark.parametrize("date, testdf, dl", dl_files("briefing_case_types", briefing_documents))
+def test_briefing_case_types_parsed(date, testdf, dl):
+    "same as parse_briefing gives the parsers"
+    assert dl is not None
+    file = dl()
+    assert file is not None
+
+    pages = parse_file(file, html=True, paged=True, parsed=True)
+    assert all(type(page) == Page for page in pages)
+
+    df = briefing_case_types(dateutil.parser.parse(date), pages, "")
+    pd.testing.assert_frame_equal(testdf, df, check_dtype=False)
+
+
+def test_page_copy():
+    page = Page(BeautifulSoup("<div><p>ผู้ป่วย 1,234</p></div>", "lxml").div)
+    assert page.get_text() == "ผู้ป่วย 1,234"
+    for other in [copy.copy(page), pickle.loads(pickle.dumps(page))]:
+        assert other.get_text() == page.get_text()
+        assert str(other) == str(page)
+        assert other.find("p").get_text() == "ผู้ป่วย 1,234"
+
+
 @pytest.mark.parametrize("date, testdf, dl", dl_files("briefing_province_cases", briefing_documents))
 def test_briefing_province_cases(date, testdf, dl):
     assert dl is not None
@@ -26,27 +26,76 @@ def daterange(start_date, end_date, offset=0):
 
 def spread_date_range(start, end, row, columns):
     "take some values and spread it over a period of dates in proportion to data already there"
-    r = list(daterange(start, end, offset=1))
-    stats = [float(p) / len(r) for p in row]
-    results = pd.DataFrame([[date] + stats for date in r], columns=columns).set_index("Date")
-    return results
+    return spread_date_ranges([start], [end], [row], columns[1:]).rename_axis(columns[0])
+
+
+def spread_date_ranges(starts, ends, values, columns):
+    "spread each row of values evenly over the days from its start to end. Where ranges overlap the first value is kept"
+    starts = pd.DatetimeIndex(starts).to_numpy()
+    days = np.maximum((pd.DatetimeIndex(ends).to_numpy() - starts) // np.timedelta64(1, "D") + 1, 0)
+    first_day = np.repeat(np.cumsum(days) - days, days)
+    dates = np.repeat(starts, days) + (np.arange(days.sum()) - first_day).astype("timedelta64[D]")
+    values = np.asarray(values, dtype=float) / np.maximum(days, 1)[:, np.newaxis]
+    results = pd.DataFrame(np.repeat(values, days, axis=0), index=pd.DatetimeIndex(dates, name="Date"), columns=columns)
+    return results.groupby(level=0).first()
+
+
+def spread_unknown(df, unknown, start=None, end=None):
+    """
+    add totals that have no date to the rows between start and end in proportion to the values already there.
+    Rounded to whole numbers by largest remainder so the totals are kept exactly. Nothing to do if unknown is None.
+
+    >>> df = pd.DataFrame({"Pos": [1, 2, 7], "Total": [0, 0, 0]}, index=pd.date_range("2020-04-01", periods=3))
+    >>> spread_unknown(df, pd.Series({"Pos": 5, "Total": 4}), end="2020-04-03")
+                Pos  Total
+    2020-04-01    2      2
+    2020-04-02    3      1
+    2020-04-03   10      1
+    """
+    if unknown is None or not unknown.any():
+        return df
+    rows = np.ones(len(df), dtype=bool)
+    if start is not None:
+        rows &= df.index >= pd.Timestamp(start)
+    if end is not None:
+        rows &= df.index <= pd.Timestamp(end)
+    if not rows.any():
+        return df
+    values = df.loc[rows, unknown.index].astype(float)
+    # spread evenly where there is nothing to go by
+    shares = (values / values.sum()).fillna(1 / len(values)) * unknown
+    extra = np.floor(shares)
+    left = (unknown - extra.sum()).round()
+    extra += (shares - extra).rank(method="first", ascending=False) <= left
+    df = df.copy()
+    df.loc[rows, unknown.index] = df.loc[rows, unknown.index] + extra.astype(int)
+    return df
 
 
 def add_data(data, df):
     "Appends while dropping any duplicate rows"
     try:
-        data = data.append(df, verify_integrity=True)
+        data = pd.concat([data, df], verify_integrity=True)
     except ValueError:
         logger.info('detected duplicates; dropping only the duplicate rows')
         idx_names = data.index.names
         if [None] != idx_names:
             data = data.reset_index()
-        data = data.append(df.reset_index()).drop_duplicates()
+        data = pd.concat([data, df.reset_index()]).drop_duplicates()
         if [None] != idx_names:
             data = data.set_index(idx_names)
     return data
 
 
+def combine_first_all(frames):
+    "same as combining each frame in turn with combine_first but with a single concat"
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames)
+    return df.groupby(level=list(range(df.index.nlevels))).first().sort_index(axis=1)
+
+
 def check_cum(df, results, cols):
     if results.empty:
         return True
@@ -95,6 +144,50 @@ def daily2cum(results):
     cum = cum.reset_index().set_index(names)
     return cum[cum.columns]
 
+
+def prov_panel(df, level="Province"):
+    """Turn a frame indexed by Date,Province into a Date x Province x column array covering every day.
+    Also returns the days, the provinces and the first and last day position of each province"""
+    dates = df.index.get_level_values("Date")
+    codes, provs = pd.factorize(df.index.get_level_values(level), sort=True)
+    all_days = pd.date_range(dates.min(), dates.max(), name="Date")
+    day_pos = all_days.get_indexer(dates)
+    panel = np.full((len(all_days), len(provs), len(df.columns)), np.nan)
+    panel[day_pos, codes] = df.to_numpy(dtype=float)
+    first = np.full(len(provs), len(all_days))
+    np.minimum.at(first, codes, day_pos)
+    last = np.full(len(provs), -1)
+    np.maximum.at(last, codes, day_pos)
+    return panel, all_days, provs, first, last
+
+
+def panel_to_frame(panel, all_days, provs, first, last, columns, level="Province"):
+    "Reverse of prov_panel. Only days between the first and last day of each province are kept"
+    days = np.arange(len(all_days))[:, np.newaxis]
+    day_i, prov_i = np.nonzero((days >= first) & (days <= last))
+    index = pd.MultiIndex.from_arrays([all_days[day_i], provs[prov_i]], names=["Date", level])
+    return pd.DataFrame(panel[day_i, prov_i], index=index, columns=columns)
+
+
+def cum2daily_prov(results, level="Province"):
+    "Same as df.groupby(level).apply(cum2daily) but for all provinces at once"
+    cols = [c for c in results.columns if " Cum" in c]
+    panel, all_days, provs, first, last = prov_panel(results[cols], level)
+    daily = np.full_like(panel, np.nan)
+    daily[1:] = panel[1:] - panel[:-1]  # we got cumilitive data
+    renames = [c.rstrip(' Cum') for c in cols]
+    return panel_to_frame(daily, all_days, provs, first, last, renames, level)
+
+
+def daily2cum_prov(results, level="Province"):
+    "Same as df.groupby(level).apply(daily2cum) but for all provinces at once"
+    cols = [c for c in results.columns if " Cum" not in c]
+    panel, all_days, provs, first, last = prov_panel(results[cols], level)
+    cum = np.where(np.isnan(panel), 0, panel).cumsum(axis=0)
+    renames = [c + ' Cum' for c in cols]
+    return panel_to_frame(cum, all_days, provs, first, last, renames, level)
+
+
 def fix_gaps(df):
     # Some gaps in the data so fill them in. df.groupby("Province").apply(fix_gaps)
     df = df.reset_index("Province")
@@ -252,16 +345,57 @@ def import_csv(name, index=None, return_empty=False, date_cols=['Date'], dir="ap
         return old
 
 
+def prov_rolling(values, func):
+    """Apply func to values as a Date x Province panel so rolling calculations stay within each province.
+    Values can be for a single province or all provinces at once, indexed by Date and any other level.
+    Windows are over each province's rows, so a missing date doesn't take part in the window
+
+    >>> s = pd.Series([1.0, 2.0, 3.0, 10.0, 20.0], index=pd.MultiIndex.from_tuples(
+    ...     [(1, "A"), (2, "A"), (3, "A"), (1, "B"), (3, "B")], names=["Date", "Province"]))
+    >>> prov_rolling(s, lambda panel: panel.rolling(2).mean()).tolist()
+    [nan, 1.5, 2.5, nan, 15.0]
+    """
+    levels = [n for n in values.index.names if n != "Date"]
+    if not levels:
+        return func(values)
+    panel = values.unstack(levels)
+    if panel.size != len(values):
+        # some provinces are missing dates so do each province by itself
+        return values.groupby(level=levels, group_keys=False).apply(func).reindex(values.index)
+    result = func(panel).stack(levels)
+    return result.reorder_levels(values.index.names).reindex(values.index)
+
+
+def trend(values, ma=7):
+    "Change in the ma day MA over the last ma days. Same as .rolling(ma).apply(trendline) on the MA"
+    mean = values.rolling(ma, min_periods=1).mean()
+    slope = (mean - mean.shift(ma - 1)) / ma
+    return slope.where(mean.notna().rolling(ma).sum() == ma)
+
+
+def trend_lstsq(values, ma=7):
+    "Least squares slope over a rolling window. Same as .rolling(ma).apply(trendline_slow)"
+    pos = pd.Series(np.arange(len(values), dtype=float), index=values.index)
+    sum_y = values.rolling(ma, min_periods=ma).sum()
+    # sum of pos * y within each window, re-based so each window starts at 0
+    sum_iy = values.mul(pos, axis=0).rolling(ma, min_periods=ma).sum() - sum_y.mul(pos - (ma - 1), axis=0)
+    sum_i = ma * (ma - 1) / 2
+    sum_ii = (ma - 1) * ma * (2 * ma - 1) / 6
+    return (ma * sum_iy - sum_i * sum_y) / (ma * sum_ii - sum_i ** 2)
+
+
+@functools.lru_cache(maxsize=100, typed=False)
 def increasing(col, ma=7):
     def increasing_func(adf: pd.DataFrame) -> pd.DataFrame:
         if callable(col):
             series = col(adf)
         else:
             series = adf[col]
-        return series.rolling(ma, min_periods=1).mean().rolling(ma, min_periods=ma).apply(trendline)
+        return prov_rolling(series, lambda panel: trend(panel, ma))
     return increasing_func
 
 
+@functools.lru_cache(maxsize=100, typed=False)
 def decreasing(col, ma=7):
     inc_func = increasing(col, ma)
 
@@ -270,10 +404,11 @@ def decreasing(col, ma=7):
     return decreasing_func
 
 
+@functools.lru_cache(maxsize=100, typed=False)
 def value_ma(col, ma=3):
     if ma:
         def cases_ma(adf: pd.DataFrame) -> pd.DataFrame:
-            return adf[col].rolling(ma, min_periods=1).mean()
+            return prov_rolling(adf[col], lambda panel: panel.rolling(ma, min_periods=1).mean())
     else:
         def cases_ma(adf: pd.DataFrame) -> pd.DataFrame:
             return adf[col]
@@ -292,42 +427,63 @@ def trendline_slow(data: pd.DataFrame, order: int = 1) -> float:
     return float(coeffs[-2])
 
 
+class ProvinceRanking:
+    """Ranks provinces for top N charts. Each metricfunc is applied to all provinces only once and
+    the sum of all provinces is done once so several charts on the same df can share the work"""
+
+    def __init__(self, df):
+        self.df = df
+        self.panels = {}
+        self.totals = None
+
+    def panel(self, func):
+        "Date x Province values of func for all provinces"
+        if func not in self.panels:
+            self.panels[func] = func(self.df).unstack("Province")
+        return self.panels[func]
+
+    def ranking(self, metricfunc):
+        "All provinces ordered by metricfunc on the last day with data"
+        panel = self.panel(metricfunc)
+        last_day = panel.loc[panel.dropna(how="all").last_valid_index()]
+        ranked = last_day.nlargest(len(last_day)).to_frame("Value")
+        ranked["Rank"] = range(1, len(ranked) + 1)
+        return ranked
+
+    def rest(self, provinces, name, other_name):
+        "Sum of all the provinces not in provinces, indexed by Date and name"
+        if self.totals is None:
+            numeric = self.df.select_dtypes("number").groupby(level="Date")
+            self.totals = numeric.sum(), numeric.count()
+        totals, counts = self.totals
+        top = self.df[self.df.index.get_level_values("Province").isin(provinces)]
+        top = top.select_dtypes("number").groupby(level="Date")
+        rest = totals.sub(top.sum(), fill_value=0)
+        rest = rest.where(counts.sub(top.count(), fill_value=0) > 0)  # same as sum(min_count=1)
+        rest[name] = other_name
+        return rest.set_index(name, append=True)
+
+    def top(self, metricfunc, valuefunc=None, name="Top 5 Provinces", num=5, other_name="Rest of Thailand"):
+        "return df with columns of valuefunc for the top x provinces by metricfunc"
+        valuefunc = metricfunc if valuefunc is None else valuefunc
+        provinces = list(self.ranking(metricfunc).index[:num])
+        series = self.panel(valuefunc)[provinces]
+        if other_name:
+            series = series.assign(**{other_name: valuefunc(self.rest(provinces, name, other_name)).unstack(name)[other_name]})
+        series.columns.name = name
+        return series.dropna(how="all")
+
+
 def topprov(df, metricfunc, valuefunc=None, name="Top 5 Provinces", num=5, other_name="Rest of Thailand", return_all=False):
-    "return df with columns of valuefunc for the top x provinces by metricfunc"
-    # Top 5 dfcine rollouts
-    # old_index = df.index.names
-    valuefunc = metricfunc if valuefunc is None else valuefunc
-
-    # Apply metric on each province by itself
-    with_metric = df.groupby(level="Province", group_keys=False).apply(metricfunc)
-    with_metric = with_metric.reset_index().set_index("Date")
-    metric_col = [c for c in with_metric.columns if c != 'Province']
-
-    # = metricfunc(df)
-    last_day = with_metric.loc[with_metric.dropna().last_valid_index()]
-    top5 = last_day.nlargest(num, metric_col).reset_index()
-
-    # top5 = df.groupby(level="Province", group_keys=False).agg({metric_col:metricfunc}).nlargest(num, metric_col)
-
-    # sort data into top 5 + rest
-    top5[name] = top5['Province']
-    df = df.join(top5.set_index("Province")[name], on="Province").reset_index()
-    if other_name:
-        df[name] = df[name].fillna(other_name)
-        # TODO: sum() might have to be configurable?
-        # TODO: we only really need to do this for one value not all the individual values
-        df = df.groupby(["Date", name]).sum(min_count=1).reset_index()  # condense all the "other" fields
-    # apply the value function to get all the values
-    values = df.set_index(["Date", name]).groupby(level=name, group_keys=False).apply(valuefunc).rename(0).reset_index()
-    # put the provinces into cols. use max to ensure NA aren't included. Should only be one value anyway?
-    # TODO: is aggfunc=lambda df: df.sum(skipna=False) better?
-    series = pd.crosstab(index=values['Date'], columns=values[name], values=values[0], aggfunc="max")
-
-    cols = list(top5[name])  # in right order
-    if other_name:
-        return series[cols + [other_name]]
+    """return df with columns of valuefunc for the top x provinces by metricfunc.
+    metricfunc and valuefunc get all provinces at once so should work per row or use prov_rolling (e.g. increasing).
+    Use ProvinceRanking directly to make several charts from the same df."""
+    ranking = ProvinceRanking(df)
+    series = ranking.top(metricfunc, valuefunc, name=name, num=num, other_name=other_name)
+    if return_all:
+        return series, ranking.ranking(metricfunc)
     else:
-        return series[cols]
+        return series
 
 
 def pred_vac(dose1, dose2=None, ahead=90, lag=40, suffix=" Pred"):
@@ -1,17 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import dateutil
+import functools
+import hashlib
 from io import StringIO
 from itertools import compress, cycle
 import os
 from pathlib import Path
 import pickle
+import posixpath
 import re
 import sys
 import urllib.parse
+import xml.etree.ElementTree as ET
+import zipfile
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from loguru import logger
-from pptx import Presentation
+import openpyxl
 from pytwitterscraper import TwitterScraper
 import requests
 from requests.exceptions import Timeout, ConnectionError
@@ -95,7 +101,35 @@ logger.add(sys.stderr, format=formatter, enqueue=True)
 ####################
 # Extraction helpers
 #####################
-def parse_file(filename, html=False, paged=True, remove_corrupt=True):
+class Page:
+    "A parsed page from parse_file that works like its BeautifulSoup node but only extracts the text once"
+
+    def __init__(self, soup):
+        self.soup = soup
+        self._text = None
+
+    def get_text(self, *args, **kwargs):
+        if args or kwargs:
+            return self.soup.get_text(*args, **kwargs)
+        if self._text is None:
+            self._text = self.soup.get_text()
+        return self._text
+
+    def __getattr__(self, name):
+        if name == "soup" or name.startswith("__"):
+            # not set up yet, e.g. while unpickling or copying
+            raise AttributeError(name)
+        return getattr(self.soup, name)
+
+    def __str__(self):
+        return str(self.soup)
+
+    def __repr__(self):
+        return repr(self.soup)
+
+
+def parse_file(filename, html=False, paged=True, remove_corrupt=True, parsed=False):
+    "text of a pdf via tika. html=True gives the html of each page instead, parsed=True as Page objects not strings"
     pages_txt = []
 
     # Read PDF file
@@ -112,7 +146,7 @@ def parse_file(filename, html=False, paged=True, remove_corrupt=True):
         if not paged:
             return repr(xhtml_data)
         else:
-            return [repr(xhtml_data)]
+            return [Page(xhtml_data) if parsed else repr(xhtml_data)]
 
     # TODO: slides are divided by slide-content and slide-master-content rather than being contained
     for i, content in enumerate(pages):
@@ -128,7 +162,7 @@ def parse_file(filename, html=False, paged=True, remove_corrupt=True):
         # Add pages
         text = parsed_content["content"].strip()
         if html:
-            pages_txt.append(repr(content))
+            pages_txt.append(Page(content) if parsed else repr(content))
         else:
             pages_txt.append(text)
     if paged:
@@ -137,21 +171,38 @@ def parse_file(filename, html=False, paged=True, remove_corrupt=True):
         return '\n\n\n'.join(pages_txt)
 
 
+def page_kinds(text, kinds):
+    "names of the kinds (name: phrase or regex) the page text could be, so pages only go to the parsers that want them"
+    return {name for name, match in kinds.items() if (match in text if type(match) == str else match.search(text))}
+
+
+@functools.lru_cache(maxsize=1000, typed=False)
+def match_pattern(match):
+    "compiled regex to split content on 'match' keeping what matched"
+    return re.compile(f"({match})")
+
+
+@functools.lru_cache(maxsize=100, typed=False)
+def thai_norm(text):
+    "normalised text without tonemarks. Pages get searched many times so only done once per page"
+    return pythainlp.util.remove_tonemark(pythainlp.util.normalize(text))
+
+
 def get_next_numbers(content, *matches, debug=False, before=False, remove=0, ints=True, until=None, return_rest=True, return_until=False, require_until=False, dash_as_zero=False, thainorm=False, asserted=False):
     """
     returns the numbers that appear immediately before or after the string(s) in 'matches',
     optionally up through 'until', that are found in the parsed PDF string 'content'
     """
     if thainorm:
-        content = pythainlp.util.remove_tonemark(pythainlp.util.normalize(content))
-        until = pythainlp.util.remove_tonemark(pythainlp.util.normalize(until))
-        matches = [pythainlp.util.remove_tonemark(pythainlp.util.normalize(match)) for match in matches]
+        content = thai_norm(content)
+        until = thai_norm(until) if until is not None else None
+        matches = [thai_norm(match) for match in matches]
 
     if len(matches) == 0:
         matches = [""]
     for match in matches:
         if type(match) == str:
-            match = re.compile(f"({match})")
+            match = match_pattern(match)
         ahead, *behind = match.split(content, 1) if match else ("", "", content)
         if not behind:
             continue
@@ -217,24 +268,112 @@ def slide2text(slide):
     return text
 
 
+def xlsx_columns(file, columns, sheet=0, header=0):
+    "Some columns of a sheet as a DataFrame. Streamed with openpyxl in read only mode so the other columns aren't read in"
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = wb.worksheets[sheet].iter_rows(min_row=header + 1, max_col=max(columns) + 1, values_only=True)
+        names = next(rows)
+        data = [[row[col] if col < len(row) else None for col in columns] for row in rows]
+    finally:
+        wb.close()
+    return pd.DataFrame(data, columns=[names[col] for col in columns])
+
+
+# bump when pptx2chartdata changes so the charts kept by pptx_charts get read again
+PPTX_CHARTS_VERSION = 2
+
+PPTX_NS = dict(
+    a="http://schemas.openxmlformats.org/drawingml/2006/main",
+    c="http://schemas.openxmlformats.org/drawingml/2006/chart",
+    p="http://schemas.openxmlformats.org/presentationml/2006/main",
+    r="http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    rel="http://schemas.openxmlformats.org/package/2006/relationships",
+)
+
+
 def pptx2chartdata(file):
+    """(chart part, title, series, slide) of each chart in a pptx.
 
-    def find_charts(shape, i):
-        if not shape.has_chart:
-            for s in getattr(shape, 'shapes', []):  # Group shapes
-                yield from find_charts(s, i)
-            return
-        chart = shape.chart
-        if chart is None:
-            return
-        title = chart.chart_title.text_frame.text if chart.has_title else ""
-        series = dict([(s.name, s.values) for s in chart.series])
-        yield chart, title, series, i
+    Only the presentation, slide and chart xml is read rather than loading the whole presentation into python-pptx.
+    Series and titles are read the same way as python-pptx's chart.series and chart_title.
+    """
+    a, c, p, r = (f"{{{PPTX_NS[ns]}}}" for ns in "acpr")
+
+    def rels(zf, part):
+        folder, name = posixpath.split(part)
+        path = posixpath.join(folder, "_rels", f"{name}.rels")
+        if path not in zf.NameToInfo:
+            return {}
+        return {rel.get("Id"): (rel.get("Type").rsplit("/", 1)[-1], part_path(folder, rel.get("Target")))
+                for rel in ET.fromstring(zf.read(path)).iterfind("rel:Relationship", PPTX_NS)
+                if rel.get("TargetMode") != "External"}
+
+    def part_path(folder, target):
+        # targets are relative to the part unless they start with / for the root of the package
+        path = target[1:] if target.startswith("/") else posixpath.join(folder, target)
+        return posixpath.normpath(path)
+
+    def find_charts(shapes):
+        for shape in shapes:
+            if shape.tag == f"{p}grpSp":  # Group shapes
+                yield from find_charts(shape)
+            elif shape.tag == f"{p}graphicFrame":
+                chart = shape.find("a:graphic/a:graphicData/c:chart", PPTX_NS)
+                if chart is not None:
+                    yield chart.get(f"{r}id")
+
+    def paragraph_text(para):
+        return "".join("\v" if el.tag == f"{a}br" else el.findtext("a:t", "", PPTX_NS)
+                       for el in para if el.tag in (f"{a}r", f"{a}br", f"{a}fld"))
+
+    def values(ser):
+        val = ser.find("c:val", PPTX_NS)
+        val = ser.find("c:yVal", PPTX_NS) if val is None else val  # XY charts
+        if val is None:
+            return ()
+        count = val.find(".//c:ptCount", PPTX_NS)
+        points = {}
+        for pt in val.iter(f"{c}pt"):
+            points.setdefault(int(pt.get("idx")), float(pt.findtext("c:v", namespaces=PPTX_NS)))
+        return tuple(points.get(idx) for idx in range(int(count.get("val")) if count is not None else 0))
+
+    def chart_data(chart):
+        title = chart.find("c:title", PPTX_NS)
+        paras = title.iterfind("c:tx/c:rich/a:p", PPTX_NS) if title is not None else []
+        title = "\n".join(paragraph_text(para) for para in paras)
+        series = {}
+        for xchart in chart.find("c:plotArea", PPTX_NS):
+            if not xchart.tag.endswith("Chart"):
+                continue  # axes etc
+            sers = sorted(xchart.iterfind("c:ser", PPTX_NS), key=lambda ser: int(ser.find("c:order", PPTX_NS).get("val")))
+            for ser in sers:
+                name = ser.find("c:tx//c:pt/c:v", PPTX_NS)
+                series[name.text if name is not None else ""] = values(ser)
+        return title, series
+
+    with zipfile.ZipFile(file) as zf:
+        presentation = next(target for kind, target in rels(zf, "").values() if kind == "officeDocument")
+        slides = rels(zf, presentation)
+        slide_ids = ET.fromstring(zf.read(presentation)).iterfind("p:sldIdLst/p:sldId", PPTX_NS)
+        for i, slide_id in enumerate(slide_ids):
+            slide = slides[slide_id.get(f"{r}id")][1]
+            slide_rels = rels(zf, slide)
+            if not any(kind == "chart" for kind, _ in slide_rels.values()):
+                continue  # no need to read the shapes
+            for chart_id in find_charts(ET.fromstring(zf.read(slide)).find("p:cSld/p:spTree", PPTX_NS)):
+                if chart_id not in slide_rels:
+                    continue
+                part = slide_rels[chart_id][1]
+                title, series = chart_data(ET.fromstring(zf.read(part)).find("c:chart", PPTX_NS))
+                yield part, title, series, i
 
-    prs = Presentation(file)
-    for i, slide in enumerate(prs.slides):
-        for shape in slide.shapes:
-            yield from find_charts(shape, i)
+
+def pptx_charts(file):
+    "(title, series, slide) of each chart in a pptx. Kept per file so a presentation is only read again if it changes"
+    store = os.path.join("inputs/pptx_charts", f"{os.path.basename(file)}.pickle")
+    return file_results(file, store, PPTX_CHARTS_VERSION,
+                        lambda: [(title, series, i) for chart, title, series, i in pptx2chartdata(file)])
 
 
 ####################
@@ -305,19 +444,75 @@ def links_html_namer(url, _):
     return "-".join(url.split("/")[2:]) + ".html"
 
 
-def web_links(*index_urls, ext=".pdf", dir="inputs/html", match=None, filenamer=links_html_namer, check=True):
-    def is_ext(a):
-        return len(a.get("href").rsplit(ext)) == 2 if ext else True
+def page_links(index_url, dir="inputs/html", filenamer=links_html_namer, check=True):
+    """(href, text) of each link on an index page.
+
+    Kept with the page's ETag/Last-Modified so the page is only fetched again and parsed if it's changed.
+    If check is False then the kept links are used without asking the server.
+    """
+    file = os.path.join(dir, filenamer(index_url, False))
+    store = f"{file}.links.pickle"
+    stored = None
+    if os.path.exists(store):
+        try:
+            with open(store, "rb") as f:
+                stored = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError):
+            logger.warning("Error loading links {}: ignoring", store)
+    if stored is not None and not check:
+        return stored["links"]
+
+    headers = {}
+    if stored is not None and stored["etag"]:
+        headers["If-None-Match"] = stored["etag"]
+    if stored is not None and stored["modified"]:
+        headers["If-Modified-Since"] = stored["modified"]
+    r = None
+    if check or not os.path.exists(file):
+        session = requests.Session()
+        fix_timeouts(session)
+        try:
+            r = session.get(index_url, timeout=5, headers=headers, allow_redirects=True)
+        except (Timeout, ConnectionError) as e:
+            logger.info("Error downloading: {}: {}", index_url, str(e))
+    if r is not None and r.status_code == 304:
+        return stored["links"]
+    if r is not None and r.status_code < 300:
+        content = r.content
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(file, "wb") as f:
+            f.write(content)
+        etag, modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    elif stored is not None:
+        logger.info("Error downloading: {}: using cache", index_url)
+        return stored["links"]
+    elif os.path.exists(file):
+        with open(file, "rb") as f:
+            content = f.read()
+        etag, modified = None, None
+    else:
+        logger.info("Error downloading: {}: skipping", index_url)
+        return []
+
+    # only the anchors are needed so parse locally rather than through tika
+    soup = BeautifulSoup(content, features="lxml", parse_only=SoupStrainer("a"))
+    links = [(a.get("href"), a.get_text(strip=True)) for a in soup.find_all("a") if a.get("href")]
+    with open(store, "wb") as f:
+        pickle.dump(dict(etag=etag, modified=modified, links=links), f)
+    return links
+
 
-    def is_match(a):
-        return a.get("href") and is_ext(a) and (match.search(a.get_text(strip=True)) if match else True)
+def web_links(*index_urls, ext=".pdf", dir="inputs/html", match=None, filenamer=links_html_namer, check=True):
+    def is_match(href, text):
+        return (len(href.rsplit(ext)) == 2 if ext else True) and (match.search(text) if match else True)
 
-    for index_url in index_urls:
-        for file, index, _ in web_files(index_url, dir=dir, check=check, filenamer=filenamer):
-            soup = parse_file(file, html=True, paged=False)
-            links = (urllib.parse.urljoin(index_url, a.get('href')) for a in soup.find_all('a') if is_match(a))
-            for link in links:
-                yield link
+    # index pages are fetched at the same time but their links are still returned in order
+    with ThreadPoolExecutor(max_workers=min(len(index_urls), 10) or 1) as pool:
+        pages = pool.map(lambda url: page_links(url, dir=dir, filenamer=filenamer, check=check), index_urls)
+        for index_url, links in zip(index_urls, pages):
+            for href, text in links:
+                if is_match(href, text):
+                    yield urllib.parse.urljoin(index_url, href)
 
 
 def web_files(*urls, dir=os.getcwd(), check=CHECK_NEWER, strip_version=False, appending=False, filenamer=url2filename):
@@ -482,18 +677,34 @@ def dav_files(url, username=None, password=None,
 #################
 # Twitter helpers
 #################
+@functools.lru_cache(maxsize=None, typed=False)
+def twitter():
+    "one scraper shared by every call so tweets looked up once aren't fetched again"
+    return TwitterScraper()
+
+
+@functools.lru_cache(maxsize=1000, typed=False)
+def tweet_text(tw, tweet_id):
+    return tw.get_tweetinfo(tweet_id).contents['text']
+
+
+@functools.lru_cache(maxsize=1000, typed=False)
+def tweet_comments(tw, tweet_id):
+    return sorted(tw.get_tweetcomments(tweet_id).contents, key=lambda t: t['id'])
+
+
 def parse_tweet(tw, tweet, found, *matches):
     """if tweet contains any of matches return its text joined with comments by the same person
     that also match (and contain [1/2] etc)"""
     if not any_in(tweet.get('text', tweet.get("comment", "")), *matches):
         return ""
-    text = tw.get_tweetinfo(tweet['id']).contents['text']
+    text = tweet_text(tw, tweet['id'])
     if any(text in t for t in found):
         return ""
     # TODO: ensure tweets are [1/2] etc not just "[" and by same person
     if "[" not in text:
         return text
-    for t in sorted(tw.get_tweetcomments(tweet['id']).contents, key=lambda t: t['id']):
+    for t in tweet_comments(tw, tweet['id']):
         rest = parse_tweet(tw, t, found + [text], *matches)
         if rest and rest not in text:
             text += " " + rest
@@ -501,23 +712,32 @@ def parse_tweet(tw, tweet, found, *matches):
 
 
 def get_tweets_from(userid, datefrom, dateto, *matches):
-    """return tweets from single person that match, merging in followups of the form [1/2]. Caches to speed up"""
+    """return tweets from single person that match, merging in followups of the form [1/2]. Caches to speed up.
+    Only tweets newer than the last seen for these matches are looked at again"""
 
-    tw = TwitterScraper()
+    tw = twitter()
     filename = os.path.join("inputs", "tweets", f"tweets2_{userid}.pickle")
     os.makedirs("inputs/tweets", exist_ok=True)
     try:
         with open(filename, "rb") as fp:
-            tweets = pickle.load(fp)
+            store = pickle.load(fp)
     except (IOError, EOFError, OSError, pickle.PickleError, pickle.UnpicklingError) as e:
         logger.info('Error detected when attempting to load the pickle file: {}, setting an empty \'tweets\' dictionary', e)
+        store = dict(tweets={}, since_id={})
+    if "tweets" not in store:
+        # older cache of just the tweets by date
         tweets = {}
-    for date, tweet_list in tweets.items():
-        fixed = []
-        for tweet in tweet_list:
-            text, url = (tweet, None) if type(tweet) == str else tweet
-            fixed.append((text, (url if url else None)))
-        tweets[date] = fixed
+        for date, tweet_list in store.items():
+            fixed = []
+            for tweet in tweet_list:
+                text, url = (tweet, None) if type(tweet) == str else tweet
+                fixed.append((text, (url if url else None)))
+            tweets[date] = fixed
+        store = dict(tweets=tweets, since_id={})
+    tweets = store['tweets']
+    # the same user is searched for different tweets so keep where each search got up to
+    key = tuple(getattr(match, "pattern", match) for match in matches)
+    since_id = store['since_id'].get(key)
     latest = max(tweets.keys()) if tweets else None
     if latest and dateto and latest >= (datetime.datetime.today() if not dateto else dateto).date():
         return tweets
@@ -529,6 +749,8 @@ def get_tweets_from(userid, datefrom, dateto, *matches):
             # Either requests exception or intermittent Exception("ID User Not Found!")
             resp = []
         for tweet in sorted(resp, key=lambda t: t['id']):
+            if since_id is not None and tweet['id'] <= since_id:
+                continue
             date = tweet['created_at'].date()
             url = tweet['urls'][0]['url'] if tweet['urls'] else f"https://twitter.com/{userid}/status/{tweet['id']}"
             text = parse_tweet(tw, tweet, tweets.get(date, []), *matches)
@@ -538,12 +760,19 @@ def get_tweets_from(userid, datefrom, dateto, *matches):
         earliest = min(tweets.keys())
         latest = max(tweets.keys())
         logger.info("got tweets {} to {} {}", earliest, latest, len(tweets))
-        if earliest <= datefrom.date():  # TODO: ensure we have every tweet in sequence?
+        # a full page of new tweets means some could be missing in between
+        caught_up = since_id is None or not resp or any(tweet['id'] <= since_id for tweet in resp)
+        if resp and caught_up:
+            # only moved on once there's no gap, otherwise the next run would start after the missing tweets.
+            # tweets already added are skipped by parse_tweet when looked at again
+            newest = max(tweet['id'] for tweet in resp)
+            store['since_id'][key] = newest if since_id is None else max(since_id, newest)
+        if earliest <= datefrom.date() and caught_up:  # TODO: ensure we have every tweet in sequence?
             break
         else:
             logger.info("Retrying: Earliest {}", earliest)
     with open(filename, "wb") as fp:
-        pickle.dump(tweets, fp)
+        pickle.dump(store, fp)
     return tweets
 
 
@@ -640,13 +869,55 @@ def replace_matcher(matches, replacements=None):
     return replace_match
 
 
-def camelot_cache(file, page_num, process_background=False, table=0):
-    fname = f"{os.path.basename(file)}.{page_num}.{table}.{process_background}.json"
+def file_results(file, store, version, parse):
+    "results of parse() for file. Kept in store so they are only parsed again if the file or parser version changes"
+    with open(file, "rb") as f:
+        file_hash = hashlib.md5(f.read()).hexdigest()
+    if os.path.exists(store):
+        try:
+            stored = pd.read_pickle(store)
+        except Exception as e:  # e.g. saved with a different pandas version
+            logger.info("{} Results can't be loaded: {}", file, e)
+        else:
+            if stored.get('version') == version and stored.get('file') == file_hash:
+                return stored['results']
+    results = parse()
+    os.makedirs(os.path.dirname(store), exist_ok=True)
+    pd.to_pickle(dict(version=version, file=file_hash, results=results), store)
+    return results
+
+
+def stored_results(dir, version, skip=()):
+    "results kept by file_results in dir for this parser version, except for the stores in skip"
+    for store in sorted(Path(dir).glob("*.pickle")):
+        if str(store) in skip:
+            continue
+        try:
+            stored = pd.read_pickle(store)
+        except Exception as e:
+            logger.info("{} Results can't be loaded: {}", store, e)
+            continue
+        if stored.get('version') == version:
+            yield stored['results']
+
+
+def camelot_tables(file, page_nums, process_background=False):
+    "tables on each of page_nums. Missing pages are read by camelot in one go and stored in one file per pdf"
     os.makedirs("inputs/camelot", exist_ok=True)
-    cache_file = os.path.join("inputs/camelot", fname)
+    cache_file = os.path.join("inputs/camelot", f"{os.path.basename(file)}.{process_background}.pickle")
+    tables = {}
     if os.path.exists(cache_file):
-        return pd.read_json(cache_file)
-    else:
-        tables = camelot.read_pdf(file, pages=str(page_num), process_background=process_background)
-        tables[table].df.to_json(cache_file)
-        return tables[table].df
+        with open(cache_file, "rb") as f:
+            tables = pickle.load(f)
+    missing = sorted(set(page_nums) - set(tables))
+    if missing:
+        found = camelot.read_pdf(file, pages=",".join(str(p) for p in missing), process_background=process_background)
+        for page_num in missing:
+            tables[page_num] = [t.df for t in found if int(t.page) == page_num]
+        with open(cache_file, "wb") as f:
+            pickle.dump(tables, f)
+    return {page_num: tables[page_num] for page_num in page_nums}
+
+
+def camelot_cache(file, page_num, process_background=False, table=0):
+    return camelot_tables(file, [page_num], process_background=process_background)[page_num][table]
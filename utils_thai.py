@@ -1,5 +1,6 @@
 import datetime
 import functools
+import hashlib
 from dateutil.parser import parse as d
 import difflib
 import json
@@ -525,13 +526,53 @@ def region_crosstab(df, col, suffix="", aggfunc="sum"):
     return given_by_area_2
 
 
+class SeriesKey:
+    "Series as an lru_cache key. Two are the same if they have the same name and values"
+
+    def __init__(self, series):
+        self.series = series
+        self.key = (hashlib.sha1(pd.util.hash_pandas_object(series).to_numpy().tobytes()).hexdigest(), series.name)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
 def trend_table(table_provinces, sensitivity=25, style="green_up"):
     """Given Series indexed by date,province with a single value.
     Return latest values indexed by province with trend between (-1, +1)
     """
+    return cached_trend_table(SeriesKey(table_provinces), sensitivity, style).copy()
+
+
+@functools.lru_cache(maxsize=20, typed=False)
+def cached_trend_table(table_provinces, sensitivity, style):
+    return calc_trend_table(table_provinces.series, sensitivity, style)
+
+
+def calc_trend_table(table_provinces, sensitivity=25, style="green_up"):
+    # Put values in a row x Province array so rolling and shift stay within a province
+    values = table_provinces.to_numpy(dtype=float)
+    prov_i, provs = pd.factorize(table_provinces.index.get_level_values("Province"))
+    row_i = table_provinces.groupby(level="Province").cumcount().to_numpy()
+    date_i, dates = pd.factorize(table_provinces.index.get_level_values("Date"))
+
+    def to_panel(long, rows):
+        panel = np.full((rows.max() + 1, len(provs)), np.nan)
+        panel[rows, prov_i] = long
+        return panel
+
+    def shift_diff(long, days):
+        panel = to_panel(long, row_i)
+        diff = np.full_like(panel, np.nan)
+        diff[days:] = panel[days:] - panel[:-days]
+        return diff[row_i, prov_i]
+
     # 14day MA just for cases
     #ma = table_provinces[['Cases','region']]
-    ma = table_provinces.groupby("Province").apply(lambda df: df.rolling(14).mean())
+    ma = pd.DataFrame(to_panel(values, row_i)).rolling(14).mean().to_numpy()[row_i, prov_i]
 
     # Too sensitive to changes
     # trend = table_provinces.groupby("Province", group_keys=False).apply(increasing(lambda df: df, 3)).to_frame("Trend")
@@ -541,21 +582,16 @@ def trend_table(table_provinces, sensitivity=25, style="green_up"):
 
     # Use the per population number
     if "rank" in style:
-        rank = ma.groupby("Date").apply(lambda df: df.rank())
-        peak = rank.max().max()
-        trend = rank.groupby("Province").apply(lambda df: (df - df.shift(7)) / peak * sensitivity)
+        # rank across provinces for each date
+        rank = pd.DataFrame(to_panel(ma, date_i)).rank(axis=1).to_numpy()[date_i, prov_i]
+        peak = np.nanmax(rank)
+        trend = shift_diff(rank, 7) / peak * sensitivity
     else:
-        ma_pop = ma.to_frame("Value").join(get_provinces()['Population'], on='Province')
-        peak = ma.max().max() / ma_pop['Population'].max().max()
-        trend = ma_pop.groupby("Province", group_keys=False).apply(
-            lambda df: ((df['Value'] - df['Value'].shift(7)) / df['Population'])
-        ) / peak * sensitivity
-
-    trend = trend[~trend.index.duplicated()]  # TODO: not sure why increasing puts duplicates in?
-    ma = ma.to_frame("MA").assign(
-        Trend=trend,
-        Value=table_provinces
-    )
+        population = get_provinces()['Population'].reindex(provs).to_numpy()[prov_i]
+        peak = np.nanmax(ma) / np.nanmax(population)
+        trend = shift_diff(ma, 7) / population / peak * sensitivity
+
+    ma = pd.DataFrame(dict(MA=ma, Trend=trend, Value=values), index=table_provinces.index)
 
     ma = ma.reset_index("Province")
     last_day = ma.loc[ma.last_valid_index()]